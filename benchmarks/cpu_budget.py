@@ -0,0 +1,99 @@
+# Aggregate throughput of llama.cpp and a torch model running at the same time, with and without the CPU budget.
+#
+#   python benchmarks/cpu_budget.py [--seconds 15] [--llama-model models/llama/model.bin] [--pin]
+#
+# Each engine runs in its own process (like the bot with ModelServer.enabled), so they compete for cores the way they
+# would in the bot. Without --llama-model a second torch workload stands in for llama.cpp.
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "llmchat"))
+from cpu_budget import CpuBudget
+
+
+def torch_workload(threads: int, seconds: float, cores: list[int], start, results, name: str):
+    import torch
+    if cores:
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    a, b = torch.randn(512, 512), torch.randn(512, 512)
+    start.wait()
+    ops, end = 0, time.time() + seconds
+    while time.time() < end:
+        torch.mm(a, b)
+        ops += 1
+    results[name] = ops / seconds
+
+
+def llama_workload(model_path: str, threads: int, seconds: float, cores: list[int], start, results, name: str):
+    from llama_cpp import Llama
+    if cores:
+        os.sched_setaffinity(0, cores)
+    llama = Llama(model_path=model_path, n_ctx=512, n_threads=threads, n_batch=32, verbose=False)
+    tokens = llama.tokenize(b" The quick brown fox jumps over the lazy dog." * 8)[:256]
+    start.wait()
+    evaluated, end = 0, time.time() + seconds
+    while time.time() < end:
+        llama.reset()
+        llama.eval(tokens)
+        evaluated += len(tokens)
+    results[name] = evaluated / seconds
+
+
+def run(engines: dict[str, tuple[int, list[int]]], args) -> dict[str, float]:
+    # engines: name -> (threads, cores to pin to or [])
+    ctx = multiprocessing.get_context("spawn")
+    manager = ctx.Manager()
+    results = manager.dict()
+    start = ctx.Barrier(len(engines))
+    processes = []
+    for name, (threads, cores) in engines.items():
+        if name == "llama" and args.llama_model:
+            target, params = llama_workload, (args.llama_model, threads, args.seconds, cores, start, results, name)
+        else:
+            target, params = torch_workload, (threads, args.seconds, cores, start, results, name)
+        processes.append(ctx.Process(target=target, args=params))
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    return dict(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--llama-model", default=None, help="GGML model for a real llama.cpp workload")
+    parser.add_argument("--torch-engine", default="whisper", help="which torch engine's share to use")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--pin", action="store_true")
+    args = parser.parse_args()
+
+    budget = CpuBudget(args.threads, args.pin)
+    everything = budget.threads
+    with budget.engine("llama"), budget.engine(args.torch_engine):
+        llama_threads, torch_threads = budget.threads_for("llama"), budget.threads_for(args.torch_engine)
+        llama_cores = budget.cores_for("llama") if budget.pin else []
+        torch_cores = budget.cores_for(args.torch_engine) if budget.pin else []
+
+    print(f"{everything} threads, budget: llama {llama_threads}, {args.torch_engine} {torch_threads}")
+    alone = {
+        **run({"llama": (everything, [])}, args),
+        **run({args.torch_engine: (everything, [])}, args),
+    }
+    unbudgeted = run({"llama": (everything, []), args.torch_engine: (everything, [])}, args)
+    budgeted = run({"llama": (llama_threads, llama_cores), args.torch_engine: (torch_threads, torch_cores)}, args)
+
+    unit = "tokens/s" if args.llama_model else "matmuls/s"
+    print(f"{'':<12}{'llama (' + unit + ')':>24}{args.torch_engine + ' (matmuls/s)':>24}{'aggregate':>12}")
+    for label, results in [("alone", alone), ("no budget", unbudgeted), ("budget", budgeted)]:
+        # aggregate: sum of each engine's throughput relative to running alone, 2.0 would be perfect scaling
+        aggregate = sum([results[name] / alone[name] for name in results])
+        print(f"{label:<12}{results['llama']:>24.1f}{results[args.torch_engine]:>24.1f}{aggregate:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Buffer allocations & forced splits of the old fixed 5s voice buffer vs. the per-speaker ring buffer.
+#
+#   python benchmarks/voice_buffer.py [--speakers 10] [--utterances 200] [--max-seconds 12]
+#
+# Feeds 20ms stereo frames for random-length utterances (1s to --max-seconds). The recognizer releases each
+# utterance a few utterances later, like a slow recognition worker would.
+import argparse
+import os
+import random
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "llmchat"))
+from ring_buffer import AudioRingBuffer
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+FRAME = 960
+
+
+class OldBuffer:
+    # what BufferAudioSink did: a 5s buffer, reallocated after every utterance, flushed when full
+    def __init__(self):
+        self.size = SAMPLE_RATE * 5
+        self.buffer = np.zeros(shape=(self.size, CHANNELS), dtype='int16')
+        self.pointer = 0
+        self.allocations = 1
+        self.splits = 0
+
+    def flush(self):
+        utterance = self.buffer[:self.pointer]
+        self.pointer = 0
+        self.buffer = np.zeros(shape=(self.size, CHANNELS), dtype='int16')
+        self.allocations += 1
+        return utterance
+
+    def append(self, frame):
+        if self.pointer + FRAME >= self.size:
+            self.flush()
+            self.splits += 1
+        self.buffer[self.pointer:self.pointer + FRAME] = frame
+        self.pointer += FRAME
+
+
+def run_old(utterances: list[tuple[int, int]], speakers: int) -> dict:
+    buffers = [OldBuffer() for _ in range(speakers)]
+    frame = np.ones(shape=(FRAME, CHANNELS), dtype='int16')
+    start = time.perf_counter()
+    frames = 0
+    for speaker, length in utterances:
+        for _ in range(length):
+            buffers[speaker].append(frame)
+        frames += length
+        buffers[speaker].flush()
+    elapsed = time.perf_counter() - start
+    return {
+        "allocations": sum([b.allocations for b in buffers]),
+        "copies": 0,
+        "splits": sum([b.splits for b in buffers]),
+        "us/frame": elapsed / frames * 1e6,
+    }
+
+
+def run_ring(utterances: list[tuple[int, int]], speakers: int, release_after: int) -> dict:
+    buffers = [AudioRingBuffer(SAMPLE_RATE * 10, CHANNELS, SAMPLE_RATE * 60) for _ in range(speakers)]
+    in_flight = deque()
+    frame = np.ones(shape=(FRAME, CHANNELS), dtype='int16')
+    splits = 0
+    start = time.perf_counter()
+    frames = 0
+    for speaker, length in utterances:
+        ring = buffers[speaker]
+        for _ in range(length):
+            if not ring.append(frame):
+                in_flight.append((ring, ring.take()[1]))
+                ring.append(frame)
+                splits += 1
+        frames += length
+        in_flight.append((ring, ring.take()[1]))
+        while len(in_flight) > release_after:
+            ring_, lease = in_flight.popleft()
+            ring_.release(lease)
+    elapsed = time.perf_counter() - start
+    return {
+        "allocations": sum([b.allocations for b in buffers]),
+        "copies": sum([b.copies for b in buffers]),
+        "splits": splits,
+        "us/frame": elapsed / frames * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--speakers", type=int, default=10)
+    parser.add_argument("--utterances", type=int, default=200)
+    parser.add_argument("--max-seconds", type=float, default=12)
+    parser.add_argument("--in-flight", type=int, default=4, help="utterances still being recognized at any time")
+    args = parser.parse_args()
+
+    random.seed(0)
+    frames_per_second = SAMPLE_RATE // FRAME
+    utterances = [(random.randrange(args.speakers), random.randint(frames_per_second, int(args.max_seconds * frames_per_second)))
+                  for _ in range(args.utterances)]
+    print(f"{args.speakers} speakers, {args.utterances} utterances, {sum([l for _, l in utterances]) / frames_per_second:.0f}s of audio")
+
+    print(f"{'':<8}{'allocations':>12}{'copies':>8}{'splits':>8}{'us/frame':>10}")
+    for label, result in [("old", run_old(utterances, args.speakers)), ("ring", run_ring(utterances, args.speakers, args.in_flight))]:
+        print(f"{label:<8}{result['allocations']:>12}{result['copies']:>8}{result['splits']:>8}{result['us/frame']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
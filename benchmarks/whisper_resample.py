@@ -0,0 +1,71 @@
+# Whisper input preparation: AudioData.get_raw_data(convert_rate=16000) (audioop) vs. the direct numpy/scipy path.
+#
+#   python benchmarks/whisper_resample.py [--seconds 5] [--runs 50]
+#
+# Both turn a 48khz stereo int16 utterance into mono float32 at 16khz. The error column compares each against
+# an FFT resample of the true mono signal.
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.signal import resample
+from speech_recognition import AudioData
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "llmchat"))
+from llmchat.sr_sources.whisper import to_whisper_input
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+
+def audiodata_path(samples: np.ndarray) -> np.ndarray:
+    # what Whisper.recognize_speech does with the AudioData the sink used to build
+    data = AudioData(samples, SAMPLE_RATE * CHANNELS, samples.dtype.itemsize)
+    raw = data.get_raw_data(convert_rate=16_000)
+    return np.frombuffer(raw, dtype=np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def direct_path(samples: np.ndarray) -> np.ndarray:
+    return to_whisper_input(samples, SAMPLE_RATE)
+
+
+def time_it(fn, samples: np.ndarray, runs: int) -> float:
+    fn(samples)
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(samples)
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    # voice-ish test signal: a few harmonics with vibrato, slightly different per channel, plus noise
+    rng = np.random.default_rng(0)
+    t = np.arange(int(args.seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    f0 = 150 + 20 * np.sin(2 * np.pi * 3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voice = sum([np.sin(k * phase) / k for k in range(1, 12)]) * 6000
+    left, right = voice + rng.normal(0, 200, len(t)), 0.8 * voice + rng.normal(0, 200, len(t))
+    samples = np.stack([left, right], axis=1).astype(np.int16)
+
+    reference = resample(samples.mean(axis=1) / 32768, len(t) // 3).astype(np.float32)
+
+    print(f"{args.seconds}s of 48khz stereo, {args.runs} runs")
+    print(f"{'':<12}{'ms':>10}{'x realtime':>12}{'rms error':>12}")
+    for label, fn in [("audiodata", audiodata_path), ("direct", direct_path)]:
+        secs = time_it(fn, samples, args.runs)
+        out = fn(samples)
+        n = min(len(out), len(reference))
+        error = np.sqrt(np.mean((out[:n] - reference[:n]) ** 2))
+        print(f"{label:<12}{secs * 1000:>10.2f}{args.seconds / secs:>12.0f}{error:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Word error rate & real-time factor of each Whisper model, with and without int8 quantization.
+#
+#   python benchmarks/whisper_rtf.py --corpus recordings/ [--models tiny,base,small] [--quantize both] [--batch 4]
+#
+# The corpus is a directory of utterances as .wav files, each with a .txt file of the same name holding what was said.
+# Record a few from the people that talk to the bot, in the rooms they talk in. Real-time factor is decode time over
+# audio duration, below 1 is faster than real time. With --batch the corpus is also decoded in batches of that size,
+# like utterances from several speakers that finish together.
+import argparse
+import os
+import re
+import sys
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "llmchat"))
+from llmchat.sr_sources.whisper import WhisperModel, WHISPER_TIERS, WHISPER_SAMPLE_RATE, to_whisper_input
+
+
+def load_corpus(path: str) -> list[tuple[str, np.ndarray, str]]:
+    corpus = []
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".wav"):
+            continue
+        transcript_path = os.path.join(path, name[:-4] + ".txt")
+        if not os.path.exists(transcript_path):
+            print(f"Skipping {name}, no {name[:-4]}.txt")
+            continue
+        with wave.open(os.path.join(path, name)) as wav:
+            if wav.getsampwidth() != 2:
+                print(f"Skipping {name}, only 16 bit wavs are supported")
+                continue
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16).reshape(-1, wav.getnchannels())
+            samples = to_whisper_input(samples, wav.getframerate())
+        with open(transcript_path) as f:
+            corpus.append((name, samples, f.read()))
+    return corpus
+
+
+def words(text: str) -> list[str]:
+    return re.sub(r"[^a-z0-9' ]", " ", text.lower()).split()
+
+
+def word_errors(reference: list[str], hypothesis: list[str]) -> int:
+    # edit distance over words
+    row = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        previous, row[0] = row[0], i
+        for j, hyp_word in enumerate(hypothesis, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (ref_word != hyp_word))
+    return row[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", required=True, help="directory of .wav files with matching .txt transcripts")
+    parser.add_argument("--models", default=",".join(WHISPER_TIERS.keys()))
+    parser.add_argument("--quantize", default="both", choices=["both", "on", "off"])
+    parser.add_argument("--batch", type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"No utterances in {args.corpus}")
+        return
+    duration = sum([len(samples) for _, samples, _ in corpus]) / WHISPER_SAMPLE_RATE
+    reference_words = sum([len(words(text)) for _, _, text in corpus])
+    print(f"{len(corpus)} utterances, {round(duration, 1)}s of audio, {reference_words} words")
+
+    quantize = {"both": [False, True], "on": [True], "off": [False]}[args.quantize]
+    batch_column = f"{f'RTF x{args.batch}':>11}" if args.batch > 1 else ""
+    print(f"{'model':<14}{'load s':>8}{'WER':>8}{'RTF':>8}{'worst RTF':>11}{batch_column}")
+    for tier in args.models.split(","):
+        for q in quantize:
+            start = time.perf_counter()
+            model = WhisperModel(tier, q)
+            load_time = time.perf_counter() - start
+            model.warmup()
+
+            errors, decode_time, worst = 0, 0.0, 0.0
+            for name, samples, text in corpus:
+                start = time.perf_counter()
+                result = model.transcribe(samples)
+                elapsed = time.perf_counter() - start
+                decode_time += elapsed
+                worst = max(worst, elapsed / (len(samples) / WHISPER_SAMPLE_RATE))
+                errors += word_errors(words(text), words(result))
+
+            batch_column = ""
+            if args.batch > 1:
+                start = time.perf_counter()
+                for i in range(0, len(corpus), args.batch):
+                    model.transcribe_batch([(samples,) for _, samples, _ in corpus[i:i + args.batch]])
+                batch_column = f"{(time.perf_counter() - start) / duration:>11.2f}"
+
+            label = tier + (" int8" if q else "")
+            print(f"{label:<14}{load_time:>8.1f}{errors / max(reference_words, 1):>8.1%}{decode_time / duration:>8.2f}{worst:>11.2f}{batch_column}")
+            del model
+
+
+if __name__ == "__main__":
+    main()
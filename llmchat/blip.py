@@ -2,6 +2,7 @@ from logger import logger
 from PIL.Image import Image
 
 class BLIP:
+    # no discord dependencies so it can also be hosted by the model server
     def __init__(self):
         from transformers import BlipProcessor, BlipForConditionalGeneration
         import torch
@@ -12,6 +13,11 @@ class BLIP:
         self.model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-large", torch_dtype=torch.float16).to(self.device)
 
     def process_image(self, image: Image):
+        import torch
         inputs = self.processor(image, "Image attached of", return_tensors="pt").to(self.device, torch.float16)
         generated_ids = self.model.generate(**inputs)
         return self.processor.decode(generated_ids[0], skip_special_tokens=True)
+
+    def warmup(self):
+        from PIL import Image as PILImage
+        self.process_image(PILImage.new("RGB", (64, 64)))
@@ -1,5 +1,8 @@
 import asyncio
+import functools
+import importlib
 import io
+import time
 import discord
 import requests
 from PIL import Image
@@ -14,12 +17,38 @@ from blip import BLIP
 from config import Config
 from logger import logger, console_handler, color_formatter
 from voice_support import BufferAudioSink
+from endpoint_scheduler import EndpointScheduler
 from persistence import PersistentData
+from latency import Deadline, LatencyStats, Timeline
+from speculation import SpeculativeResponder
+from model_server import ModelServer
+from model_lifecycle import ModelLifecycleManager
+from cpu_budget import CpuBudget
 
 from llm_sources import LLMSource
 from tts_sources import TTSSource
 from sr_sources import SRSource
 
+NO_LLM_MESSAGE = "No LLM is loaded! Check Bot.llm in the config and use /reload_config."
+
+# service name -> "module:class", imported when the service is first used
+LLM_SOURCES = {
+    "openai": "llm_sources.oai:OpenAI",
+    "llama": "llm_sources.llama:LLaMA",
+}
+TTS_SOURCES = {
+    "elevenlabs": "tts_sources.elevenlabs:ElevenLabs",
+    "azure": "tts_sources.azure:Azure",
+    "silero": "tts_sources.silero:SileroTTS",
+    "bark": "tts_sources.bark:Bark",
+    "play.ht": "tts_sources.playht:PlayHt",
+}
+SR_SOURCES = {
+    "whisper": "sr_sources.whisper:Whisper",
+    "google": "sr_sources.google:Google",
+    "azure": "sr_sources.azure:Azure",
+}
+
 
 class DiscordClient(discord.Client):
     config: Config
@@ -27,11 +56,19 @@ class DiscordClient(discord.Client):
     tts: TTSSource = None
     sr: SRSource = None
     db: PersistentData
-    blip: BLIP
+    blip: BLIP = None
     sink: BufferAudioSink = None
+    endpoint_scheduler: EndpointScheduler = None
+    latency_stats: LatencyStats
+    model_server: ModelServer = None
+    lifecycle: ModelLifecycleManager
+    cpu_budget: CpuBudget = None
+    speculation: SpeculativeResponder = None
 
     def __init__(self, config: Config):
         self.config = config
+        self.timeline = Timeline()
+        self.latency_stats = LatencyStats()
 
         if not self.config.can_interact_with_channel_id(-1) and not self.config.discord_active_channels:
             raise Exception(
@@ -121,9 +158,22 @@ class DiscordClient(discord.Client):
                 callback=self.reload_config,
             )
         )
+        self.tree.add_command(
+            app_commands.Command(
+                name="restart_models",
+                description="Restarts the local model server (Whisper, BLIP, Silero, Bark).",
+                callback=self.restart_models,
+            )
+        )
 
-        if self.config.bot_blip_enabled:
-            self.blip = BLIP()
+        self.lifecycle = ModelLifecycleManager(self.config.lifecycle_idle_timeout, self.config.lifecycle_ram_budget_mb)
+        if self.config.model_server_enabled:
+            self.model_server = ModelServer(self.config.lifecycle_idle_timeout, self.config.lifecycle_ram_budget_mb)
+        if self.config.cpu_budget_enabled:
+            self.cpu_budget = CpuBudget(self.config.cpu_threads, self.config.cpu_pin_cores)
+            logger.info(f"CPU budget: {self.cpu_budget.threads} threads")
+            if self.model_server:
+                self.cpu_budget.listeners.append(self.model_server.set_torch_threads)
 
         self.run(
             self.config.discord_bot_api_key,
@@ -131,57 +181,140 @@ class DiscordClient(discord.Client):
             log_formatter=color_formatter,
         )
 
-    async def setup_tts(self):
-        logger.info(f"TTS: {self.config.bot_tts_service}")
-        params = [self, self.config, self.db]
-
-        if self.config.bot_tts_service == "elevenlabs":
-            from tts_sources.elevenlabs import ElevenLabs
-            self.tts = ElevenLabs(*params)
-        elif self.config.bot_tts_service == "azure":
-            from tts_sources.azure import Azure
-            self.tts = Azure(*params)
-        elif self.config.bot_tts_service == "silero":
-            from tts_sources.silero import SileroTTS
-            self.tts = SileroTTS(*params)
-        elif self.config.bot_tts_service == "bark":
-            from tts_sources.bark import Bark
-            self.tts = Bark(*params)
-        elif self.config.bot_tts_service == "play.ht":
-            from tts_sources.playht import PlayHt
-            self.tts = PlayHt(*params)
+    def create_model(self, kind: str, loader, preload: bool = True, **options):
+        # hosted by the model server if it's enabled, otherwise loaded here and unloaded when idle / over budget.
+        # options are passed to the loader
+        if self.model_server:
+            model = self.model_server.model(kind, **options)
         else:
-            logger.critical(f"Unknown TTS service: {self.config.bot_tts_service}")
+            model = self.lifecycle.manage(kind, functools.partial(loader, **options))
+        model.cpu_budget = self.cpu_budget
+        if preload and not self.model_server:
+            model.load()
+        return model
+
+    async def release_model(self, model, timeout: float = 120) -> bool:
+        # unloads a model that's being replaced or disabled, waiting for calls that are still using it
+        if model is None:
+            return True
+        if getattr(model, "is_remote", False):
+            await self.loop.run_in_executor(None, model.unload)
+            return True
+        give_up = time.time() + timeout
+        while not await self.loop.run_in_executor(None, self.lifecycle.release, model):
+            if time.time() > give_up:
+                logger.warn(f"{model.name} is still in use after {timeout}s, it stays loaded until it's idle")
+                return False
+            await asyncio.sleep(0.5)
+        return True
+
+    async def restart_models(self, ctx: Interaction):
+        if not self.model_server:
+            await ctx.response.send_message("The model server isn't enabled! (ModelServer.enabled)", delete_after=5)
+            return
 
-    async def setup_llm(self):
-        logger.info(f"LLM: {self.config.bot_llm}")
-        params = [self, self.config, self.db]
-        if self.config.bot_llm == "openai":
-            from llm_sources.oai import OpenAI
-            self.llm = OpenAI(*params)
-        elif self.config.bot_llm == "llama":
-            from llm_sources.llama import LLaMA
-            self.llm = LLaMA(*params)
-        else:
-            logger.critical(f"Unknown LLM: {self.config.bot_llm}")
+        await ctx.response.defer()
+        await self.loop.run_in_executor(None, self.model_server.restart)
+        followup: discord.WebhookMessage = await ctx.followup.send(content="Model server restarted. Models will be reloaded when they're next used.")
+        await followup.delete(delay=5)
+
+    async def build_source(self, kind: str, sources: dict[str, str], name: str):
+        logger.info(f"{kind}: {name}")
+        if name not in sources:
+            logger.critical(f"Unknown {kind}: {name}")
+            return None
+        module_name, class_name = sources[name].split(":")
+        # importing pulls in the service's SDK (langchain, azure, ...), which would block the gateway
+        module = await self.loop.run_in_executor(None, importlib.import_module, module_name)
+        return getattr(module, class_name)(self, self.config, self.db)
+
+    async def build_llm(self) -> LLMSource:
+        return await self.build_source("LLM", LLM_SOURCES, self.config.bot_llm)
+
+    async def build_tts(self) -> TTSSource:
+        return await self.build_source("TTS", TTS_SOURCES, self.config.bot_tts_service)
 
+    async def build_sr(self) -> SRSource:
+        return await self.build_source("Speech recognition service", SR_SOURCES, self.config.bot_speech_recognition_service)
+
+    async def setup_llm(self):
+        # LLaMA models keep loading in the background, the presence shows the progress
+        self.llm = await self.build_llm()
+        if self.llm is None:
+            await self.change_presence(activity=discord.Game(name="No LLM!"))
+            return
         await self.change_presence(activity=discord.Game(name=self.llm.current_model_name))
         logger.info(f"Current model: {self.llm.current_model_name}")
 
+    async def setup_tts(self):
+        self.tts = await self.build_tts()
+        if self.tts is not None:
+            await self.tts.load()
+
     async def setup_sr(self):
-        logger.info(f"Speech recognition service: {self.config.bot_speech_recognition_service}")
-        params = [self, self.config, self.db]
-        if self.config.bot_speech_recognition_service == "whisper":
-            from sr_sources.whisper import Whisper
-            self.sr = Whisper(*params)
-        elif self.config.bot_speech_recognition_service == "google":
-            from sr_sources.google import Google
-            self.sr = Google(*params)
-        elif self.config.bot_speech_recognition_service == "azure":
-            from sr_sources.azure import Azure
-            self.sr = Azure(*params)
+        self.sr = await self.build_sr()
+        if self.sr is not None:
+            await self.sr.load()
+
+    async def setup_blip(self):
+        blip = self.create_model("blip", BLIP, preload=False)
+        await self.loop.run_in_executor(None, blip.load)
+        self.blip = blip
+
+    async def warmup_llm(self):
+        if self.llm is None:
+            return
+        await self.llm.load()
+        await self.llm.warmup()
+
+    async def warmup_blip(self):
+        await self.loop.run_in_executor(None, self.blip.warmup)
+
+    async def swap_service(self, name: str, build) -> bool:
+        # the old instance keeps serving while the new one loads, then the reference is swapped
+        start_time = time.time()
+        new = await build()
+        if new is None:
+            logger.error(f"Keeping the current {name}, the new one is unknown")
+            return False
+        await new.load()
+        old = getattr(self, name)
+        setattr(self, name, new)
+        if name == "sr" and self.sink:
+            self.sink.sr_source = new
+        logger.info(f"Swapped {name} to {type(new).__name__} in {round(time.time() - start_time, 1)}s")
+        if name == "llm":
+            await self.change_presence(activity=discord.Game(name=self.llm.current_model_name))
+        if old is not None:
+            self.loop.create_task(self.release_when_idle(old))
+        return True
+
+    async def release_when_idle(self, old, timeout: float = 120):
+        # requests that started on the old instance hold their own reference, let them finish first
+        give_up = time.time() + timeout
+        while old.busy and time.time() < give_up:
+            await asyncio.sleep(0.5)
+        # sources drop their model reference on unload, keep it to check it's really gone
+        model = getattr(old, "lifecycle", None) or getattr(old, "model", None)
+        await old.unload()
+        if self.still_loaded(model):
+            logger.warn(f"Released {type(old).__name__}, but its model is still loaded")
+        else:
+            logger.info(f"Released {type(old).__name__}")
+
+    @staticmethod
+    def still_loaded(model) -> bool:
+        # remote models are unloaded by the model server, a RemoteModel has no loaded state
+        return model is not None and not getattr(model, "is_remote", False) and getattr(model, "loaded", False) is True
+
+    async def swap_blip(self, enabled: bool):
+        if enabled:
+            await self.setup_blip()
         else:
-            logger.critical(f"Unknown speech recognition service: {self.config.bot_speech_recognition_service}")
+            old, self.blip = self.blip, None
+            await self.release_model(old)
+            if self.still_loaded(old):
+                logger.warn("BLIP was disabled, but it's still loaded")
 
     async def reload_config(self, ctx: Interaction):
         await ctx.response.defer()
@@ -189,24 +322,27 @@ class DiscordClient(discord.Client):
         try:
             prev_llm, prev_blip, prev_tts, prev_speech = self.config.bot_llm, self.config.bot_blip_enabled, self.config.bot_tts_service, self.config.bot_speech_recognition_service
             self.config.load()
-            # manually load new settings if necessary
+            # new services are loaded in parallel while the current ones keep serving
+            swaps = []  # (service name, swap)
             if prev_llm != self.config.bot_llm:
-                await self.setup_llm()
+                swaps.append((self.config.bot_llm, self.swap_service("llm", self.build_llm)))
             if prev_blip != self.config.bot_blip_enabled:
-                if not self.config.bot_blip_enabled:
-                    del self.blip
-                    self.blip = None
-                else:
-                    self.blip = BLIP()
+                swaps.append(("blip", self.swap_blip(self.config.bot_blip_enabled)))
             if prev_tts != self.config.bot_tts_service:
-                await self.setup_tts()
+                swaps.append((self.config.bot_tts_service, self.swap_service("tts", self.build_tts)))
             if prev_speech != self.config.bot_speech_recognition_service:
-                del self.sr
-                self.sr = None
-                await self.setup_sr()
-
-            self.llm.on_config_reloaded()
-
+                swaps.append((self.config.bot_speech_recognition_service, self.swap_service("sr", self.build_sr)))
+            results = await asyncio.gather(*[swap for _, swap in swaps])
+            unknown = [name for (name, _), swapped in zip(swaps, results) if swapped is False]
+
+            if self.llm is not None:
+                self.llm.on_config_reloaded()
+
+            if unknown:
+                logger.warn(f"Config reloaded, kept the current services instead of: {', '.join(unknown)}")
+                followup: discord.WebhookMessage = await ctx.followup.send(content=f"Config reloaded, but these services are unknown and weren't switched: {', '.join(unknown)}")
+                await followup.delete(delay=5)
+                return
             logger.info("Config reloaded.")
             followup: discord.WebhookMessage = await ctx.followup.send(content="Config reloaded.")
             await followup.delete(delay=3)
@@ -216,17 +352,22 @@ class DiscordClient(discord.Client):
             await followup.delete(delay=5)
 
     async def retry_last_message(self, ctx: Interaction):
+        if self.llm is None:
+            await ctx.response.send_message(NO_LLM_MESSAGE, delete_after=5)
+            return
         history_item = self.db.last
+        deadline = self.new_deadline(self.config.latency_text_budget)
 
         await ctx.response.defer()
 
         if not history_item:
-            response = await self.llm.generate_response(ctx.user)
+            response = await self.llm.generate_response(ctx.user, deadline, ctx.channel.id)
             sent_message = await self.send_message(response, ctx.followup)
             await self.store_embedding((ctx.user.id, response, sent_message[0].id))
             self.db.append(sent_message[0], override_content=response)
+            self.loop.create_task(self.llm.update_summary())
             if self.config.bot_audiobook_mode and ctx.guild.voice_client:
-                await self.say(response, ctx.guild.voice_client, ctx.channel)
+                await self.say(response, ctx.guild.voice_client, ctx.channel, deadline=deadline)
             return
 
         author_id, content, message_id = history_item
@@ -234,18 +375,19 @@ class DiscordClient(discord.Client):
 
         if author_id != self.user.id:
             # not from me
-            response = await self.llm.generate_response(ctx.user)
+            response = await self.llm.generate_response(ctx.user, deadline, ctx.channel.id)
             sent_message = await self.send_message(response, ctx.followup)
             await self.store_embedding((ctx.user.id, response, sent_message[0].id))
             self.db.append(sent_message[0], override_content=response)
+            self.loop.create_task(self.llm.update_summary())
             if self.config.bot_audiobook_mode and ctx.guild.voice_client:
-                await self.say(response, ctx.guild.voice_client, ctx.channel)
+                await self.say(response, ctx.guild.voice_client, ctx.channel, deadline=deadline)
         else:
             delete_me = await ctx.followup.send(content="Retrying...", silent=True)
             await delete_me.delete()
             await last_message.edit(content="*Retrying...*")
             self.db.remove(last_message.id)
-            response = await self.llm.generate_response(ctx.user)
+            response = await self.llm.generate_response(ctx.user, deadline, ctx.channel.id)
 
             if len(response) < 2000:
                 await last_message.edit(content=response)
@@ -256,8 +398,9 @@ class DiscordClient(discord.Client):
 
             await self.store_embedding((ctx.user.id, response, last_message.id))
             self.db.append(last_message, override_content=response)
+            self.loop.create_task(self.llm.update_summary())
             if self.config.bot_audiobook_mode and ctx.guild.voice_client:
-                await self.say(response, ctx.guild.voice_client, ctx.channel)
+                await self.say(response, ctx.guild.voice_client, ctx.channel, deadline=deadline)
 
     async def set_message_context_count(self, ctx: Interaction, count: int):
         self.config.llm_context_messages_count = count
@@ -270,10 +413,9 @@ class DiscordClient(discord.Client):
         vc: discord.VoiceClient = ctx.guild.voice_client
         if vc and vc.is_connected():
             if self.config.bot_audiobook_mode:
-                vc.stop_listening()
+                self.stop_listening(vc)
             else:
-                self.sink = BufferAudioSink(self.sr, self.on_speech, self.loop)
-                vc.listen(self.sink)
+                self.start_listening(vc)
 
         await ctx.response.send_message(
             f"Audiobook mode is now **{'on' if status else 'off'}**.", delete_after=3
@@ -312,26 +454,54 @@ class DiscordClient(discord.Client):
             name, identity = _identity
 
         embed = discord.Embed(title="Chatbot info")
-        llm_str = f"**{self.config.bot_llm}**: {self.llm.current_model_name}\n"
+        llm_str = f"**{self.config.bot_llm}**: {self.llm.current_model_name if self.llm else '*Unavailable!*'}\n"
         llm_str += f"⚙️ Temperature: {self.config.llm_temperature}\n"
         llm_str += f"⚙️ Presence penalty: {self.config.llm_presence_penalty}\n"
         llm_str += f"⚙️ Frequency penalty: {self.config.llm_frequency_penalty}\n"
         llm_str += f"⚙️ Context history count: {self.config.llm_context_messages_count}\n"
         llm_str += f"⚙️ Max tokens: {'Unlimited' if self.config.llm_max_tokens == 0 else self.config.llm_max_tokens}\n"
+        if self.config.llm_stable_prefix and self.llm:
+            shared, total = self.llm.prefix_stats
+            llm_str += f"⚙️ Shared prompt prefix: {shared}/{total} tokens\n"
 
         embed.add_field(name="📝 LLM", value=llm_str, inline=False)
-        embed.add_field(name="🗣️ TTS", value=f"**{self.config.bot_tts_service}**: {self.tts.current_voice_name}",
+        if self.llm and self.llm.is_openai and self.llm.router.enabled:
+            embed.add_field(name="🔀 Model routing", value=self.llm.router.summary(), inline=False)
+        if self.config.bot_llm == "llama" and self.llm:
+            embed.add_field(name="🦙 Resident models", value=f"{self.llm.pool.summary()}\n{self.llm.kv_cache.summary()}", inline=False)
+            embed.add_field(name="🦙 Inference worker", value=self.llm.worker.summary(), inline=False)
+        embed.add_field(name="🗣️ TTS", value=f"**{self.config.bot_tts_service}**: {self.tts.current_voice_name if self.tts else '*Unavailable!*'}",
                         inline=False)
-        embed.add_field(name="🗨️ SR", value=f"**{self.config.bot_speech_recognition_service}**", inline=False)
+        sr_str = f"**{self.config.bot_speech_recognition_service}**\n{self.sr.summary() if self.sr else '*Unavailable!*'}"
+        if self.sink:
+            sr_str += f"\n{self.sink.recognizers.summary()}"
+            if self.sink.streaming:
+                sr_str += f"\n{self.sink.segments} segment(s) recognized while people were still talking"
+        embed.add_field(name="🗨️ SR", value=sr_str, inline=False)
+        if self.speculation:
+            embed.add_field(name="🔮 Speculative replies", value=self.speculation.summary(), inline=False)
+        models_str = self.lifecycle.summary()
+        if self.model_server:
+            try:
+                models_str += "\n**Model server**\n" + await self.model_server.acall("", "status")
+            except Exception as e:
+                models_str += f"\n**Model server**: {str(e)}"
+        if self.config.lifecycle_idle_timeout or self.config.lifecycle_ram_budget_mb:
+            models_str += f"\nIdle timeout: {self.config.lifecycle_idle_timeout or '-'}s, budget: {self.config.lifecycle_ram_budget_mb or '-'}MB"
+        embed.add_field(name="🧠 Local models", value=models_str, inline=False)
+        if self.cpu_budget:
+            embed.add_field(name="🖥️ CPU budget", value=self.cpu_budget.summary(), inline=False)
+        if self.config.latency_enabled:
+            embed.add_field(name="⏱️ Latency", value=f"Budget: {self.config.latency_text_budget}s (text), {self.config.latency_voice_budget}s (voice)\n" + self.latency_stats.summary(), inline=False)
 
         embed.add_field(name="\u200B", value="", inline=False)  # seperator
 
         embed.add_field(name="📛 Name", value=self.config.bot_name, inline=False)
         embed.add_field(name="✒️ Description", value=self.config.bot_identity, inline=False)
         embed.add_field(name="🎗️ Reminder",
-                        value=self.llm._insert_wildcards(self.config.bot_reminder, (name, identity)) if self.config.bot_reminder else "*Not set!*",
+                        value=self.llm._insert_wildcards(self.config.bot_reminder, (name, identity)) if self.config.bot_reminder and self.llm else self.config.bot_reminder or "*Not set!*",
                         inline=False)
-        embed.add_field(name="✍️ Initial prompt", value=self.llm._insert_wildcards(self.config.bot_initial_prompt, (name, identity)) if self.config.bot_initial_prompt else "*Not set!*", inline=False)
+        embed.add_field(name="✍️ Initial prompt", value=self.llm._insert_wildcards(self.config.bot_initial_prompt, (name, identity)) if self.config.bot_initial_prompt and self.llm else self.config.bot_initial_prompt or "*Not set!*", inline=False)
         embed.add_field(name="\u200B", value="", inline=False)  # seperator
 
         embed.add_field(
@@ -359,7 +529,7 @@ class DiscordClient(discord.Client):
             try:
                 model = ctx.data["values"][0]
                 self.llm.set_model(model)
-                await self.change_presence(activity=discord.Game(name=model))
+                await self.change_presence(activity=discord.Game(name=self.llm.current_model_name))
                 await ctx.response.edit_message(content=f"Model changed to *{self.llm.current_model_name}*", embed=None, view=None, delete_after=3)
             except Exception as e:
                 logger.error(f"Exception thrown while LLM model: {str(e)}")
@@ -379,8 +549,10 @@ class DiscordClient(discord.Client):
                 raise e
 
             view = discord.ui.View()
-            view.add_item(ui_extensions.PaginationDropdown(options=await self.llm.list_models(), callback=llm_callback, on_exception=on_exception))
-            view.add_item(ui_extensions.PaginationDropdown(options=self.tts.list_voices(), callback=voice_callback, on_exception=on_exception))
+            if self.llm is not None:
+                view.add_item(ui_extensions.PaginationDropdown(options=await self.llm.list_models(), callback=llm_callback, on_exception=on_exception))
+            if self.tts is not None:
+                view.add_item(ui_extensions.PaginationDropdown(options=self.tts.list_voices(), callback=voice_callback, on_exception=on_exception))
             await ctx.followup.send(content="Select an LLM model or a TTS voice:", view=view)
         except Exception as e:
             logger.error(f"Exception thrown while constructing model/voice pickers: {str(e)}")
@@ -389,7 +561,7 @@ class DiscordClient(discord.Client):
 
 
     async def send_system(self, ctx: Interaction, message: str):
-        if self.config.bot_llm == "openai" and self.llm.use_chat_completion:
+        if self.config.bot_llm == "openai" and self.llm and self.llm.use_chat_completion:
             await ctx.response.send_message(f"**System**: {message}")
             self.db.system(message, ctx.id)
         else:
@@ -501,46 +673,132 @@ class DiscordClient(discord.Client):
         for c in self.voice_clients:
             await c.disconnect(force=True)
 
+        self.timeline.add("connect", self.timeline.started)
         await self.change_presence(activity=discord.Game(name="Loading..."))
 
         self.db: PersistentData = PersistentData(self)
-        await self.setup_llm()
-        await self.setup_tts()
-        await self.setup_sr()
 
-        await self.tree.sync()
+        async def start(name: str, setup, warmup):
+            await self.timeline.run(name, setup())
+            if self.config.bot_warmup:
+                try:
+                    await self.timeline.run(f"{name} warmup", warmup())
+                except Exception as e:
+                    logger.warn(f"Warming up {name} failed: {str(e)}")
+
+        # nothing here depends on each other, the model loads run in executors
+        stages = [
+            start("llm", self.setup_llm, self.warmup_llm),
+            start("tts", self.setup_tts, lambda: self.tts.warmup() if self.tts else asyncio.sleep(0)),
+            start("sr", self.setup_sr, lambda: self.sr.warmup() if self.sr else asyncio.sleep(0)),
+            self.timeline.run("commands", self.tree.sync()),
+        ]
+        names = ["llm", "tts", "sr", "commands"]
+        if self.config.bot_blip_enabled:
+            stages.append(start("blip", self.setup_blip, self.warmup_blip))
+            names.append("blip")
+        # one broken stage shouldn't keep the bot from starting
+        for name, result in zip(names, await asyncio.gather(*stages, return_exceptions=True)):
+            if isinstance(result, Exception):
+                logger.critical(f"Setting up {name} failed: {str(result)}")
+
         self.event(self.on_voice_state_update)
         logger.info("Initialization complete.")
+        logger.info(self.timeline.summary())
+
+    def new_deadline(self, budget: float) -> Deadline:
+        return Deadline(budget if self.config.latency_enabled else None, self.latency_stats)
 
-    async def store_embedding(self, message: tuple[int, str, int]):
+    async def store_embedding(self, message: tuple[int, str, int], deadline: Deadline = None):
         author_id, content, message_id = message
-        if self.config.openai_use_embeddings and self.llm.is_openai:
+        if self.config.openai_use_embeddings and self.llm and self.llm.is_openai:
+            deadline = deadline or Deadline()
             async with ClientSession() as s:
                 openai.aiosession.set(s)
-                embedding = await openai.Embedding.acreate(api_base=self.config.openai_reverse_proxy_url, input=content, model="text-embedding-ada-002")
+                try:
+                    embedding = await deadline.run("embedding", openai.Embedding.acreate(api_base=self.config.openai_reverse_proxy_url, input=content, model="text-embedding-ada-002"),
+                                                   timeout=self.config.latency_embedding_timeout if self.config.latency_enabled else None)
+                except asyncio.TimeoutError:
+                    deadline.degrade("embedding", f"skipped embedding for message {message_id}")
+                    return
                 self.db.add_embedding(message, embedding['data'][0]['embedding'])
                 logger.debug("Added embedding for message " + str(message_id))
 
-    async def on_speech(self, speaker_id, speech):
-        speaker = discord.utils.get(self.get_all_members(), id=speaker_id)
-        await self.store_embedding((speaker_id, speech, -1))
-
-        vc: discord.VoiceClient = speaker.guild.voice_client
-        if not vc or not vc.is_connected():
+    def start_listening(self, vc: discord.VoiceClient):
+        if self.sr is None:
+            logger.warn("Not listening, no speech recognition service is loaded")
             return
+        if self.endpoint_scheduler is None:
+            # shared by every sink, it only runs while someone's utterance is pending
+            self.endpoint_scheduler = EndpointScheduler(self.loop)
+        if self.sink:
+            self.sink.cleanup()
+        if self.config.voice_speculative:
+            if self.speculation is None:
+                self.speculation = SpeculativeResponder(self.db)
+            self.sink = BufferAudioSink(self.sr, self.on_speech, self.loop, self.endpoint_scheduler, self.config,
+                                        self.on_tentative_speech, self.on_speech_resumed)
+        else:
+            self.sink = BufferAudioSink(self.sr, self.on_speech, self.loop, self.endpoint_scheduler, self.config)
+        vc.listen(self.sink)
 
-        self.db.speech(speaker, speech)
-        response = await self.llm.generate_response(speaker)
-        await self.store_embedding((self.user.id, response, -1))
-        self.db.speech(self.user, response)
+    def stop_listening(self, vc: discord.VoiceClient = None):
+        if self.sink:
+            if vc:
+                vc.stop_listening()
+            self.sink.cleanup()
+            self.sink = None
 
-        vc.stop()
+    async def on_speech(self, speaker_id, speech):
+        # the sink ignores the speaker until their reply is spoken, or until this fails
+        sink = self.sink
+        playing = False
 
         def _after_speaking(_):
-            self.sink.is_speaking = False
+            if sink:
+                sink.end_reply(speaker_id)
             logger.debug("Stopped speaking.")
 
-        await self.say(response, vc, after=_after_speaking)
+        try:
+            deadline = self.new_deadline(self.config.latency_voice_budget)
+            speaker = discord.utils.get(self.get_all_members(), id=speaker_id)
+            await self.store_embedding((speaker_id, speech, -1), deadline)
+
+            vc: discord.VoiceClient = speaker.guild.voice_client
+            if not vc or not vc.is_connected():
+                return
+            if self.llm is None:
+                logger.warn(f"Ignoring speech from {speaker_id}, no LLM is loaded")
+                return
+
+            response = await self.speculation.take(speaker_id, speech) if self.speculation else None
+            if response is None:
+                self.db.speech(speaker, speech)
+                response = await self.llm.generate_response(speaker, deadline, vc.channel.id, voice=True)
+            self.db.speech(self.user, response)
+            self.loop.create_task(self.llm.update_summary())
+
+            vc.stop()
+            playing = await self.say(response, vc, after=_after_speaking, deadline=deadline)
+            if not playing:
+                # no audio, fall back to the voice channel's text chat
+                await vc.channel.send(content=response)
+            await self.store_embedding((self.user.id, response, -1))
+        finally:
+            if not playing and sink:
+                sink.end_reply(speaker_id)
+
+    async def on_tentative_speech(self, speaker_id, speech):
+        # they paused and may be done, on_speech uses the reply if the final transcript is the same
+        speaker = discord.utils.get(self.get_all_members(), id=speaker_id)
+        vc: discord.VoiceClient = speaker.guild.voice_client if speaker else None
+        if not vc or not vc.is_connected() or self.llm is None:
+            return
+        deadline = self.new_deadline(self.config.latency_voice_budget)
+        self.speculation.start(speaker, speech, lambda: self.llm.generate_response(speaker, deadline, vc.channel.id, voice=True))
+
+    async def on_speech_resumed(self, speaker_id):
+        self.speculation.cancel(speaker_id)
 
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
                                     after: discord.VoiceState):
@@ -550,6 +808,7 @@ class DiscordClient(discord.Client):
         if not after.channel:
             # member left channel, check to see if there are any more members there
             if len(before.channel.members) == 1 and member.guild.voice_client:
+                self.stop_listening(member.guild.voice_client)
                 await member.guild.voice_client.disconnect(force=True)
         elif before.channel is None and after.channel is not None:
             # member joined channel, join if you haven't already
@@ -557,8 +816,7 @@ class DiscordClient(discord.Client):
                 vc: discord.VoiceClient = await after.channel.connect()
                 if self.config.bot_audiobook_mode:
                     return
-                self.sink = BufferAudioSink(self.sr, self.on_speech, self.loop)
-                vc.listen(self.sink)
+                self.start_listening(vc)
 
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
         self.db.remove(payload.message_id)
@@ -584,9 +842,21 @@ class DiscordClient(discord.Client):
             self.db.remove_embedding(payload.cached_message.id)  # remove existing
             await self.store_embedding((payload.cached_message.author.id, payload.data["content"], payload.cached_message.id))  # regenerate
 
-    async def say(self, text: str, vc: discord.VoiceClient, text_channel_ctx: discord.TextChannel = None, after=None):
+    async def say(self, text: str, vc: discord.VoiceClient, text_channel_ctx: discord.TextChannel = None, after=None, deadline: Deadline = None) -> bool:
+        # returns False if no audio will be played
+        deadline = deadline or Deadline()
+        if self.tts is None:
+            return False
+        if deadline.at_risk(self.config.latency_tts_reserve):
+            deadline.degrade("tts", "sending text without audio")
+            return False
+
         try:
-            buf: io.BytesIO = await self.tts.generate_speech(text)
+            try:
+                buf: io.BytesIO = await deadline.run("tts", self.tts.generate_speech(text))
+            except asyncio.TimeoutError:
+                deadline.degrade("tts", "sending text without audio")
+                return False
             vc.stop()
             # for now i have to write this to a file so ffmpeg won't strip the last part.
             with open("temp.wav", "wb") as f:
@@ -599,11 +869,13 @@ class DiscordClient(discord.Client):
                     raise e
 
             vc.play(discord.FFmpegOpusAudio("temp.wav"), after=_after)
+            return True
         except BaseException as e:
             logger.error(f"Exception thrown while trying to generate TTS: {str(e)}")
             if text_channel_ctx:
                 await text_channel_ctx.send(content=f"Exception thrown while trying to generate TTS:\n```{str(e)}```",
                                             silent=True)
+            return False
 
     async def on_message(self, message: discord.Message):
         if message.author.id == self.user.id \
@@ -611,8 +883,14 @@ class DiscordClient(discord.Client):
                 or not message.content:
             # from me or not allowed in channel
             return
+        if self.llm is None:
+            logger.warn(f"Ignoring message {message.id}, no LLM is loaded")
+            await message.channel.send(content=NO_LLM_MESSAGE, delete_after=5)
+            return
 
-        if self.config.bot_blip_enabled:
+        deadline = self.new_deadline(self.config.latency_text_budget)
+
+        if self.config.bot_blip_enabled and self.blip is not None:
             for a in message.attachments:
                 if not a.content_type.startswith("image/"):
                     continue
@@ -621,16 +899,21 @@ class DiscordClient(discord.Client):
                 r = requests.get(a.url, stream=True)
                 r.raise_for_status()
                 img = Image.open(r.raw).convert("RGB")
-                caption = self.blip.process_image(img)
+                try:
+                    caption = await deadline.run("caption", self.loop.run_in_executor(None, self.blip.process_image, img),
+                                                 timeout=self.config.latency_caption_timeout if self.config.latency_enabled else None)
+                except asyncio.TimeoutError:
+                    deadline.degrade("caption", "skipping image caption")
+                    continue
                 logger.info(f"Image caption: {caption}")
                 message.content += f"\n[{caption}]"
 
         self.db.append(message)
-        await self.store_embedding((message.author.id, message.content, message.id))
+        await self.store_embedding((message.author.id, message.content, message.id), deadline)
 
         async with message.channel.typing():
             try:
-                response = await self.llm.generate_response(invoker=message.author)
+                response = await self.llm.generate_response(invoker=message.author, deadline=deadline, channel_id=message.channel.id)
             except Exception as e:
                 view = discord.ui.View()
                 retry_btn = discord.ui.Button(label="Retry")
@@ -655,9 +938,10 @@ class DiscordClient(discord.Client):
         sent_message = sent_message[0]
 
         if self.config.bot_audiobook_mode and message.guild.voice_client:
-            await self.say(response, message.guild.voice_client, message.channel)
+            await self.say(response, message.guild.voice_client, message.channel, deadline=deadline)
 
         assert sent_message
         self.db.append(sent_message, override_content=response)
+        self.loop.create_task(self.llm.update_summary())
 
         await self.store_embedding((self.user.id, response, sent_message.id))
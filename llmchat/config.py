@@ -245,6 +245,15 @@ class Config:
         self._config.set("Bot", "blip_enabled", "true" if enabled is True else "false")
         self.save()
 
+    @property
+    def bot_warmup(self) -> bool:
+        return self._config.getboolean("Bot", "warmup", fallback=False)
+
+    @bot_warmup.setter
+    def bot_warmup(self, enabled):
+        self._config.set("Bot", "warmup", "true" if enabled else "false")
+        self.save()
+
     @property
     def bot_reminder(self):
         return self._config.get("Bot", "reminder", fallback="")
@@ -333,4 +342,395 @@ class Config:
     @playht_voice_id.setter
     def playht_voice_id(self, voice_id):
         self._config.set("Play.ht", "voice_id", voice_id)
-        self.save()
\ No newline at end of file
+        self.save()
+
+    @property
+    def latency_enabled(self) -> bool:
+        return self._config.getboolean("Latency", "enabled", fallback=False)
+
+    @latency_enabled.setter
+    def latency_enabled(self, enabled):
+        self._config.set("Latency", "enabled", "true" if enabled else "false")
+        self.save()
+
+    @property
+    def latency_text_budget(self) -> float:
+        return self._config.getfloat("Latency", "text_budget", fallback=30)
+
+    @latency_text_budget.setter
+    def latency_text_budget(self, budget):
+        self._config.set("Latency", "text_budget", str(budget))
+        self.save()
+
+    @property
+    def latency_voice_budget(self) -> float:
+        return self._config.getfloat("Latency", "voice_budget", fallback=8)
+
+    @latency_voice_budget.setter
+    def latency_voice_budget(self, budget):
+        self._config.set("Latency", "voice_budget", str(budget))
+        self.save()
+
+    @property
+    def latency_embedding_timeout(self) -> float:
+        return self._config.getfloat("Latency", "embedding_timeout", fallback=3)
+
+    @latency_embedding_timeout.setter
+    def latency_embedding_timeout(self, timeout):
+        self._config.set("Latency", "embedding_timeout", str(timeout))
+        self.save()
+
+    @property
+    def latency_caption_timeout(self) -> float:
+        return self._config.getfloat("Latency", "caption_timeout", fallback=10)
+
+    @latency_caption_timeout.setter
+    def latency_caption_timeout(self, timeout):
+        self._config.set("Latency", "caption_timeout", str(timeout))
+        self.save()
+
+    @property
+    def latency_recall_reserve(self) -> float:
+        return self._config.getfloat("Latency", "recall_reserve", fallback=10)
+
+    @latency_recall_reserve.setter
+    def latency_recall_reserve(self, reserve):
+        self._config.set("Latency", "recall_reserve", str(reserve))
+        self.save()
+
+    @property
+    def latency_llm_reserve(self) -> float:
+        return self._config.getfloat("Latency", "llm_reserve", fallback=8)
+
+    @latency_llm_reserve.setter
+    def latency_llm_reserve(self, reserve):
+        self._config.set("Latency", "llm_reserve", str(reserve))
+        self.save()
+
+    @property
+    def latency_tts_reserve(self) -> float:
+        return self._config.getfloat("Latency", "tts_reserve", fallback=2)
+
+    @latency_tts_reserve.setter
+    def latency_tts_reserve(self, reserve):
+        self._config.set("Latency", "tts_reserve", str(reserve))
+        self.save()
+
+    @property
+    def latency_fast_model(self) -> str:
+        return self._config.get("Latency", "fast_model", fallback="")
+
+    @latency_fast_model.setter
+    def latency_fast_model(self, model_id):
+        self._config.set("Latency", "fast_model", model_id)
+        self.save()
+
+    @property
+    def llm_cache_enabled(self) -> bool:
+        return self._config.getboolean("LLM", "cache_enabled", fallback=False)
+
+    @llm_cache_enabled.setter
+    def llm_cache_enabled(self, enabled):
+        self._config.set("LLM", "cache_enabled", "true" if enabled else "false")
+        self.save()
+
+    @property
+    def llm_cache_ttl(self) -> float:
+        return self._config.getfloat("LLM", "cache_ttl", fallback=86400)
+
+    @llm_cache_ttl.setter
+    def llm_cache_ttl(self, ttl):
+        self._config.set("LLM", "cache_ttl", str(ttl))
+        self.save()
+
+    @property
+    def llm_cache_max_entries(self) -> int:
+        return self._config.getint("LLM", "cache_max_entries", fallback=1000)
+
+    @llm_cache_max_entries.setter
+    def llm_cache_max_entries(self, max_entries):
+        self._config.set("LLM", "cache_max_entries", str(max_entries))
+        self.save()
+
+    @property
+    def llm_summarize(self) -> bool:
+        return self._config.getboolean("LLM", "summarize", fallback=False)
+
+    @llm_summarize.setter
+    def llm_summarize(self, enabled):
+        self._config.set("LLM", "summarize", "true" if enabled else "false")
+        self.save()
+
+    @property
+    def llm_summary_batch(self) -> int:
+        return self._config.getint("LLM", "summary_batch", fallback=10)
+
+    @llm_summary_batch.setter
+    def llm_summary_batch(self, batch):
+        self._config.set("LLM", "summary_batch", str(batch))
+        self.save()
+
+    @property
+    def llm_summary_max_tokens(self) -> int:
+        return self._config.getint("LLM", "summary_max_tokens", fallback=256)
+
+    @llm_summary_max_tokens.setter
+    def llm_summary_max_tokens(self, max_tokens):
+        self._config.set("LLM", "summary_max_tokens", str(max_tokens))
+        self.save()
+
+    @property
+    def llm_stable_prefix(self) -> bool:
+        return self._config.getboolean("LLM", "stable_prefix", fallback=False)
+
+    @llm_stable_prefix.setter
+    def llm_stable_prefix(self, enabled):
+        self._config.set("LLM", "stable_prefix", "true" if enabled else "false")
+        self.save()
+
+    @property
+    def openai_routing_tiers(self) -> list[str]:
+        comma_sep_tiers = self._config.get("OpenAI", "routing_tiers", fallback=None)
+        if not comma_sep_tiers:
+            return []
+        return [v.strip() for v in comma_sep_tiers.split(",")]
+
+    @openai_routing_tiers.setter
+    def openai_routing_tiers(self, tiers: list[str]):
+        self._config.set("OpenAI", "routing_tiers", ",".join(tiers))
+        self.save()
+
+    @property
+    def openai_routing_short_message_chars(self) -> int:
+        return self._config.getint("OpenAI", "routing_short_message_chars", fallback=80)
+
+    @openai_routing_short_message_chars.setter
+    def openai_routing_short_message_chars(self, chars):
+        self._config.set("OpenAI", "routing_short_message_chars", str(chars))
+        self.save()
+
+    @property
+    def openai_routing_slow_channels(self) -> list[int]:
+        comma_sep_channels = self._config.get("OpenAI", "routing_slow_channels", fallback=None)
+        if not comma_sep_channels:
+            return []
+        return [int(v.strip()) for v in comma_sep_channels.split(",")]
+
+    @openai_routing_slow_channels.setter
+    def openai_routing_slow_channels(self, channels: list[int]):
+        self._config.set("OpenAI", "routing_slow_channels", ",".join([str(v) for v in channels]))
+        self.save()
+
+    @property
+    def llama_use_mmap(self) -> bool:
+        return self._config.getboolean("LLaMA", "use_mmap", fallback=True)
+
+    @llama_use_mmap.setter
+    def llama_use_mmap(self, enabled):
+        self._config.set("LLaMA", "use_mmap", "true" if enabled else "false")
+        self.save()
+
+    @property
+    def llama_pool_memory_budget_mb(self) -> int:
+        return self._config.getint("LLaMA", "pool_memory_budget_mb", fallback=0)
+
+    @llama_pool_memory_budget_mb.setter
+    def llama_pool_memory_budget_mb(self, budget):
+        self._config.set("LLaMA", "pool_memory_budget_mb", str(budget))
+        self.save()
+
+    @property
+    def llama_channel_models(self) -> dict[int, str]:
+        comma_sep_pins = self._config.get("LLaMA", "channel_models", fallback=None)
+        if not comma_sep_pins:
+            return {}
+        ret = {}
+        for pin in comma_sep_pins.split(","):
+            channel_id, model_name = pin.split(":", 1)
+            ret[int(channel_id.strip())] = model_name.strip()
+        return ret
+
+    @llama_channel_models.setter
+    def llama_channel_models(self, pins: dict[int, str]):
+        self._config.set("LLaMA", "channel_models", ",".join([f"{c}:{m}" for c, m in pins.items()]))
+        self.save()
+
+    @property
+    def llama_kv_cache_states(self) -> int:
+        return self._config.getint("LLaMA", "kv_cache_states", fallback=2)
+
+    @llama_kv_cache_states.setter
+    def llama_kv_cache_states(self, count):
+        self._config.set("LLaMA", "kv_cache_states", str(count))
+        self.save()
+
+    @property
+    def model_server_enabled(self) -> bool:
+        return self._config.getboolean("ModelServer", "enabled", fallback=False)
+
+    @model_server_enabled.setter
+    def model_server_enabled(self, enabled):
+        self._config.set("ModelServer", "enabled", "true" if enabled else "false")
+        self.save()
+
+    @property
+    def lifecycle_idle_timeout(self) -> float:
+        return self._config.getfloat("Lifecycle", "idle_timeout", fallback=0)
+
+    @lifecycle_idle_timeout.setter
+    def lifecycle_idle_timeout(self, seconds):
+        self._config.set("Lifecycle", "idle_timeout", str(seconds))
+        self.save()
+
+    @property
+    def lifecycle_ram_budget_mb(self) -> int:
+        return self._config.getint("Lifecycle", "ram_budget_mb", fallback=0)
+
+    @lifecycle_ram_budget_mb.setter
+    def lifecycle_ram_budget_mb(self, mb):
+        self._config.set("Lifecycle", "ram_budget_mb", str(mb))
+        self.save()
+
+    @property
+    def cpu_budget_enabled(self) -> bool:
+        return self._config.getboolean("CPU", "budget_enabled", fallback=False)
+
+    @cpu_budget_enabled.setter
+    def cpu_budget_enabled(self, enabled):
+        self._config.set("CPU", "budget_enabled", "true" if enabled else "false")
+        self.save()
+
+    @property
+    def cpu_threads(self) -> int:
+        return self._config.getint("CPU", "threads", fallback=0)
+
+    @cpu_threads.setter
+    def cpu_threads(self, threads):
+        self._config.set("CPU", "threads", str(threads))
+        self.save()
+
+    @property
+    def cpu_pin_cores(self) -> bool:
+        return self._config.getboolean("CPU", "pin_cores", fallback=False)
+
+    @cpu_pin_cores.setter
+    def cpu_pin_cores(self, pin):
+        self._config.set("CPU", "pin_cores", "true" if pin else "false")
+        self.save()
+
+    @property
+    def voice_endpoint_mode(self) -> str:
+        return self._config.get("Voice", "endpoint_mode", fallback="balanced")
+
+    @voice_endpoint_mode.setter
+    def voice_endpoint_mode(self, mode):
+        self._config.set("Voice", "endpoint_mode", mode)
+        self.save()
+
+    @property
+    def voice_recognition_workers(self) -> int:
+        return self._config.getint("Voice", "recognition_workers", fallback=2)
+
+    @voice_recognition_workers.setter
+    def voice_recognition_workers(self, workers):
+        self._config.set("Voice", "recognition_workers", str(workers))
+        self.save()
+
+    @property
+    def voice_recognition_queue(self) -> int:
+        return self._config.getint("Voice", "recognition_queue", fallback=8)
+
+    @voice_recognition_queue.setter
+    def voice_recognition_queue(self, size):
+        self._config.set("Voice", "recognition_queue", str(size))
+        self.save()
+
+    @property
+    def voice_recognition_overflow(self) -> str:
+        return self._config.get("Voice", "recognition_overflow", fallback="merge")
+
+    @voice_recognition_overflow.setter
+    def voice_recognition_overflow(self, policy):
+        self._config.set("Voice", "recognition_overflow", policy)
+        self.save()
+
+    @property
+    def voice_recognition_max_age(self) -> float:
+        return self._config.getfloat("Voice", "recognition_max_age", fallback=10)
+
+    @voice_recognition_max_age.setter
+    def voice_recognition_max_age(self, seconds):
+        self._config.set("Voice", "recognition_max_age", str(seconds))
+        self.save()
+
+    @property
+    def whisper_model(self) -> str:
+        return self._config.get("Whisper", "model", fallback="base")
+
+    @whisper_model.setter
+    def whisper_model(self, tier):
+        self._config.set("Whisper", "model", tier)
+        self.save()
+
+    @property
+    def whisper_quantize(self) -> bool:
+        return self._config.getboolean("Whisper", "quantize", fallback=False)
+
+    @whisper_quantize.setter
+    def whisper_quantize(self, enabled):
+        self._config.set("Whisper", "quantize", str(enabled))
+        self.save()
+
+    @property
+    def whisper_batch_size(self) -> int:
+        return self._config.getint("Whisper", "batch_size", fallback=8)
+
+    @whisper_batch_size.setter
+    def whisper_batch_size(self, size):
+        self._config.set("Whisper", "batch_size", str(size))
+        self.save()
+
+    @property
+    def whisper_batch_window(self) -> float:
+        return self._config.getfloat("Whisper", "batch_window", fallback=0.05)
+
+    @whisper_batch_window.setter
+    def whisper_batch_window(self, seconds):
+        self._config.set("Whisper", "batch_window", str(seconds))
+        self.save()
+
+    @property
+    def voice_streaming(self) -> bool:
+        return self._config.getboolean("Voice", "streaming", fallback=False)
+
+    @voice_streaming.setter
+    def voice_streaming(self, enabled):
+        self._config.set("Voice", "streaming", str(enabled))
+        self.save()
+
+    @property
+    def voice_segment_pause(self) -> float:
+        return self._config.getfloat("Voice", "segment_pause", fallback=0.25)
+
+    @voice_segment_pause.setter
+    def voice_segment_pause(self, seconds):
+        self._config.set("Voice", "segment_pause", str(seconds))
+        self.save()
+
+    @property
+    def voice_min_segment(self) -> float:
+        return self._config.getfloat("Voice", "min_segment", fallback=1.0)
+
+    @voice_min_segment.setter
+    def voice_min_segment(self, seconds):
+        self._config.set("Voice", "min_segment", str(seconds))
+        self.save()
+
+    @property
+    def voice_speculative(self) -> bool:
+        return self._config.getboolean("Voice", "speculative", fallback=False)
+
+    @voice_speculative.setter
+    def voice_speculative(self, enabled):
+        self._config.set("Voice", "speculative", str(enabled))
+        self.save()
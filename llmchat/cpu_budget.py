@@ -0,0 +1,131 @@
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from logger import logger
+from typing import Callable
+
+# relative share of the cores each engine gets while it's active
+ENGINE_WEIGHTS = {
+    "llama": 3,
+    "whisper": 2,
+    "bark": 2,
+    "blip": 1,
+    "silero": 1,
+}
+# these share torch's intra-op thread pool, so they get one combined thread count
+TORCH_ENGINES = ["whisper", "bark", "blip", "silero"]
+
+_interop_set = False
+
+
+def apply_torch_threads(threads: int):
+    global _interop_set
+    if "torch" not in sys.modules:
+        return  # don't import torch just to configure it, it'll use the default until a model loads
+    import torch
+    if not _interop_set:
+        _interop_set = True
+        try:
+            # can only be set before torch runs anything in parallel
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+
+
+def available_cores() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class CpuBudget:
+    # splits the cores between the engines that are currently running, instead of each one using all of them
+    def __init__(self, threads: int = 0, pin: bool = False):
+        self.cores = available_cores()
+        self.threads = min(threads, len(self.cores)) if threads > 0 else len(self.cores)
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+        self.active: dict[str, int] = {}
+        self.torch_threads = self.threads
+        self.rebalances = 0
+        self.listeners: list[Callable[[int], None]] = []  # called with the new torch thread count
+        self._lock = threading.Lock()
+
+    def _shares(self) -> dict[str, int]:
+        if not self.active:
+            return {}
+        weights = {name: ENGINE_WEIGHTS.get(name, 1) for name in self.active}
+        total = sum(weights.values())
+        shares = {name: max(self.threads * weight // total, 1) for name, weight in weights.items()}
+        # cores lost to rounding go to the heaviest engine
+        heaviest = max(weights, key=weights.get)
+        shares[heaviest] += max(self.threads - sum(shares.values()), 0)
+        return shares
+
+    def _torch_share(self, shares: dict[str, int]) -> int:
+        # with more engines than cores every engine still gets a thread, but torch doesn't go over the total
+        torch_share = sum([n for name, n in shares.items() if name in TORCH_ENGINES])
+        if not torch_share:
+            return 0
+        return max(min(torch_share, self.threads - shares.get("llama", 0)), 1)
+
+    def threads_for(self, engine: str) -> int:
+        with self._lock:
+            shares = self._shares()
+        if engine in TORCH_ENGINES:
+            return self._torch_share(shares) or self.threads
+        return shares.get(engine, self.threads)
+
+    def cores_for(self, engine: str) -> list[int]:
+        # llama gets the first cores, the torch engines share the ones after it
+        with self._lock:
+            shares = self._shares()
+        llama = shares.get("llama", 0)
+        if engine in TORCH_ENGINES:
+            return self.cores[llama:llama + (self._torch_share(shares) or self.threads)] or self.cores
+        return self.cores[:shares.get(engine, self.threads)]
+
+    def _rebalance(self):
+        shares = self._shares()
+        torch_threads = self._torch_share(shares)
+        if torch_threads and torch_threads != self.torch_threads:
+            self.torch_threads = torch_threads
+            self.rebalances += 1
+            logger.debug(f"CPU budget: {shares}")
+            apply_torch_threads(torch_threads)
+            for listener in self.listeners:
+                try:
+                    listener(torch_threads)
+                except Exception as e:
+                    logger.warn(f"CPU budget listener failed: {str(e)}")
+
+    @contextmanager
+    def engine(self, engine: str):
+        # marks engine as running for the duration, yields the number of threads it should use
+        with self._lock:
+            self.active[engine] = self.active.get(engine, 0) + 1
+            self._rebalance()
+        previous_affinity = None
+        try:
+            threads = self.threads_for(engine)
+            if self.pin:
+                # only affects the calling thread. threads started from it (llama.cpp's, torch's pool on first use) inherit it
+                previous_affinity = os.sched_getaffinity(0)
+                os.sched_setaffinity(0, self.cores_for(engine))
+            yield threads
+        finally:
+            if previous_affinity is not None:
+                os.sched_setaffinity(0, previous_affinity)
+            with self._lock:
+                self.active[engine] -= 1
+                if not self.active[engine]:
+                    del self.active[engine]
+                self._rebalance()
+
+    def summary(self) -> str:
+        with self._lock:
+            shares = self._shares()
+        active = ", ".join([f"{name}: {n}" for name, n in shares.items()]) or "idle"
+        return f"{self.threads} threads{' (pinned)' if self.pin else ''}, torch: {self.torch_threads}\nActive: {active}\nRebalances: {self.rebalances}"
@@ -0,0 +1,84 @@
+import asyncio
+import math
+import time
+from typing import Callable, Hashable
+from logger import logger
+
+
+class EndpointScheduler:
+    # one timer wheel on the event loop for the endpoint checks of every voice sink, instead of a polling thread each.
+    # it only wakes up when something is due, so idle guilds cost nothing.
+    def __init__(self, loop: asyncio.AbstractEventLoop, resolution: float = 0.05, slots: int = 64):
+        self.loop = loop
+        self.resolution = resolution
+        self.slots: list[dict[Hashable, tuple[float, Callable]]] = [{} for _ in range(slots)]
+        self._slot_of: dict[Hashable, int] = {}
+        self._tick = 0  # last tick that was processed
+        self._handle: asyncio.TimerHandle = None
+        self._wake_at = 0.0  # when _handle fires
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def _tick_of(self, when: float) -> int:
+        return math.ceil(when / self.resolution)
+
+    def schedule(self, key: Hashable, when: float, callback: Callable[[], None]):
+        # thread safe, replaces anything already scheduled for key. when is a time.monotonic() timestamp, like the loop's clock
+        self.loop.call_soon_threadsafe(self._schedule, key, when, callback)
+
+    def cancel(self, key: Hashable):
+        self.loop.call_soon_threadsafe(self._cancel, key)
+
+    def _schedule(self, key: Hashable, when: float, callback: Callable[[], None]):
+        self._cancel(key)
+        if not self._slot_of:
+            # the wheel was stopped, pick up from now
+            self._tick = self._tick_of(time.monotonic()) - 1
+        slot = max(self._tick_of(when), self._tick + 1) % len(self.slots)
+        self.slots[slot][key] = (when, callback)
+        self._slot_of[key] = slot
+        self._start()
+
+    def _cancel(self, key: Hashable):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def _earliest(self) -> float:
+        return min([self.slots[slot][key][0] for key, slot in self._slot_of.items()])
+
+    def _start(self):
+        # sleeps until the earliest entry is due instead of ticking through empty slots
+        if not self._slot_of:
+            return
+        wake_at = max((self._tick + 1) * self.resolution, self._earliest())
+        if self._handle is not None:
+            if self._wake_at <= wake_at:
+                return
+            self._handle.cancel()
+        self._wake_at = wake_at
+        self._handle = self.loop.call_later(max(wake_at - time.monotonic(), 0), self._advance)
+
+    def _advance(self):
+        self._handle = None
+        now = time.monotonic()
+        if self._slot_of:
+            # nothing is due before the earliest entry, skip the ticks that were slept through
+            self._tick = max(self._tick, self._tick_of(self._earliest()) - 1)
+        # catch up on ticks that passed while the loop was busy
+        while self._tick < math.floor(now / self.resolution) and self._slot_of:
+            self._tick += 1
+            slot = self.slots[self._tick % len(self.slots)]
+            # entries more than one revolution away stay for a later round
+            due = [(key, callback) for key, (when, callback) in slot.items() if when <= now]
+            for key, callback in due:
+                del slot[key]
+                del self._slot_of[key]
+                self.fired += 1
+                try:
+                    callback()
+                except Exception as e:
+                    logger.warn(f"Endpoint check failed: {str(e)}")
+        self._start()
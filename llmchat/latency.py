@@ -0,0 +1,102 @@
+import asyncio
+import math
+import time
+from typing import Awaitable, Union
+from logger import logger
+
+
+class LatencyStats:
+    def __init__(self):
+        self.overruns: dict[str, int] = {}
+        self.degradations: dict[str, int] = {}
+
+    def record_overrun(self, stage: str):
+        self.overruns[stage] = self.overruns.get(stage, 0) + 1
+
+    def record_degradation(self, stage: str):
+        self.degradations[stage] = self.degradations.get(stage, 0) + 1
+
+    def summary(self) -> str:
+        if not self.overruns and not self.degradations:
+            return "*No overruns yet.*"
+        ret = ""
+        for stage, count in sorted(self.overruns.items()):
+            ret += f"⏰ {stage}: {count} overrun(s)\n"
+        for stage, count in sorted(self.degradations.items()):
+            ret += f"⬇️ {stage}: {count} degradation(s)\n"
+        return ret
+
+
+class Deadline:
+    # latency budget for a single reply, created in on_message / on_speech and passed down through every stage.
+    # a budget of None never expires (Latency.enabled = false)
+    def __init__(self, budget: Union[float, None] = None, stats: LatencyStats = None):
+        self.budget = budget
+        self.stats = stats or LatencyStats()
+        self.start = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    @property
+    def remaining(self) -> float:
+        if self.budget is None:
+            return math.inf
+        return max(self.budget - self.elapsed, 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining <= 0
+
+    def at_risk(self, reserve: float) -> bool:
+        # True if less than `reserve` seconds are left for the rest of the pipeline
+        return self.remaining < reserve
+
+    def degrade(self, stage: str, reason: str):
+        logger.warn(f"Latency budget at risk ({round(self.remaining, 2)}s left), {stage}: {reason}")
+        self.stats.record_degradation(stage)
+
+    async def run(self, stage: str, aw: Awaitable, timeout: float = None, minimum: float = 0.0):
+        # awaits `aw` bounded by the remaining budget (and the stage timeout, if any).
+        # `minimum` guarantees the stage some time even if the budget is already spent.
+        limit = self.remaining
+        if timeout:
+            limit = min(limit, timeout)
+        limit = max(limit, minimum)
+
+        stage_start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(aw, None if math.isinf(limit) else limit)
+        except asyncio.TimeoutError:
+            logger.warn(f"Stage '{stage}' timed out after {round(time.monotonic() - stage_start, 2)}s")
+            self.stats.record_overrun(stage)
+            raise
+
+        if self.budget is not None and self.expired:
+            logger.warn(f"Stage '{stage}' finished past the deadline ({round(self.elapsed, 2)}s > {self.budget}s)")
+            self.stats.record_overrun(stage)
+        return result
+
+
+class Timeline:
+    # when each startup stage started & how long it took, relative to when the bot started
+    def __init__(self):
+        self.started = time.time()
+        self.stages: list[tuple[str, float, float]] = []
+
+    def add(self, stage: str, start: float, end: float = None):
+        self.stages.append((stage, start - self.started, (end or time.time()) - start))
+
+    async def run(self, stage: str, aw: Awaitable):
+        start = time.time()
+        try:
+            return await aw
+        finally:
+            self.add(stage, start)
+
+    def summary(self) -> str:
+        ret = f"Startup took {round(time.time() - self.started, 1)}s:"
+        for stage, offset, duration in sorted(self.stages, key=lambda s: s[1]):
+            ret += f"\n  {stage:<16} {offset:>6.1f}s -> {offset + duration:>6.1f}s ({duration:.1f}s)"
+        return ret
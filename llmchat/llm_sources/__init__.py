@@ -1,15 +1,28 @@
 from discord import User, Client, SelectOption
 from llmchat.config import Config
 from llmchat.persistence import PersistentData
+from llmchat.latency import Deadline
+from llmchat.logger import logger
 from datetime import datetime
+from typing import Union
+import asyncio
+import hashlib
+import json
+import re
+
+# sentences of the initial prompt that mention {date}, with stable_prefix they're moved to the end of the context
+DATE_SENTENCE = re.compile(r"[^.!?\n]*\{date\}[^.!?\n]*[.!?]?")
 
 class LLMSource:
     def __init__(self, client: Client, config: Config, db: PersistentData):
         self.config = config
         self.db = db
         self.client = client
+        self._summary_lock = asyncio.Lock()
+        self._last_prompt_tokens: list[int] = []
+        self.prefix_stats = (0, 0)  # (shared tokens, total tokens) of the last request
 
-    async def generate_response(self, invoker: User = None) -> str:
+    async def generate_response(self, invoker: User = None, deadline: Deadline = None, channel_id: int = None, voice: bool = False) -> str:
         return NotImplementedError()
 
     async def list_models(self) -> list[SelectOption]:
@@ -18,6 +31,59 @@ class LLMSource:
     def set_model(self, model_id: str) -> None:
         return NotImplementedError()
 
+    async def summarize(self, previous_summary: str, transcript: str) -> str:
+        return NotImplementedError()
+
+    def get_summary_prompt(self, previous_summary: str, transcript: str) -> str:
+        prompt = f"Summarize the conversation between {self.config.bot_name} and the users below in at most {self.config.llm_summary_max_tokens // 2} words. "
+        prompt += "Keep names, facts, decisions and anything that may be referred to later. Write only the summary.\n\n"
+        if previous_summary:
+            prompt += f"Summary so far: {previous_summary}\n\n"
+        prompt += f"New messages:\n{transcript}\n\nSummary:"
+        return prompt
+
+    async def get_author_name(self, author_id: int) -> str:
+        if author_id == self.client.user.id:
+            return self.config.bot_name
+        identity = self.db.get_identity(author_id)
+        if identity is not None:
+            return identity[0]
+        return (await self.client.fetch_user(author_id)).display_name
+
+    async def update_summary(self):
+        # folds messages that have aged out of the context window into the rolling summary
+        if not self.config.llm_summarize:
+            return
+
+        async with self._summary_lock:
+            rows = self.db.get_unsummarized_messages(self.config.llm_context_messages_count)
+            if len(rows) < self.config.llm_summary_batch:
+                return
+
+            previous_summary, _ = self.db.get_summary()
+            try:
+                # fetching author names can fail too, this runs as a background task so nothing else would log it
+                transcript = ""
+                for rowid, author_id, content, message_id in rows:
+                    if author_id == -1:
+                        transcript += f"System: {content}\n"
+                    else:
+                        transcript += f"{await self.get_author_name(author_id)}: {content}\n"
+                summary = (await self.summarize(previous_summary, transcript)).strip()
+            except Exception as e:
+                logger.warn(f"Failed to update conversation summary: {str(e)}")
+                return
+
+            if summary:
+                self.db.set_summary(summary, rows[-1][0])
+                logger.debug(f"Folded {len(rows)} messages into the conversation summary: {summary}")
+
+    def get_summary_text(self) -> str:
+        if not self.config.llm_summarize:
+            return ""
+        summary, _ = self.db.get_summary()
+        return f"Summary of the earlier conversation: {summary}" if summary else ""
+
     def get_initial(self, invoker: User = None) -> str:
         user_identity = ("User", None)
         if invoker:
@@ -27,16 +93,20 @@ class LLMSource:
             else:
                 user_identity = fetched_identity
 
-        return self._insert_wildcards(self.config.bot_initial_prompt, user_identity)
+        # with stable_prefix the date is sent at the end of the context instead (see get_date_line)
+        return self._insert_wildcards(self.config.bot_initial_prompt, user_identity, volatile=not self.config.llm_stable_prefix)
 
-    def _insert_wildcards(self, text: str, user_info: tuple = None) -> str:
+    def _insert_wildcards(self, text: str, user_info: tuple = None, volatile: bool = True) -> str:
+        if not volatile:
+            # get_date_line sends these after the history instead, so the prefix stays the same all day
+            text = DATE_SENTENCE.sub("", text)
         user_name, user_identity = user_info or (None, None)
         wildcards = {
             "bot_name": self.config.bot_name,
             "bot_identity": self.config.bot_identity,
             "user_name": user_name,
             "user_identity": user_identity,
-            "date": datetime.now().strftime("%A, %B %d, %Y %H:%M"),
+            "date": self.current_date,
             "nl": "\n",
         }
 
@@ -46,6 +116,50 @@ class LLMSource:
 
         return text
 
+    @property
+    def current_date(self) -> str:
+        return datetime.now().strftime("%A, %B %d, %Y %H:%M")
+
+    def get_date_line(self) -> str:
+        if not self.config.llm_stable_prefix:
+            return ""
+        sentences = [s.replace("{nl}", " ").strip() for s in DATE_SENTENCE.findall(self.config.bot_initial_prompt or "")]
+        if sentences:
+            return self._insert_wildcards(" ".join(sentences))
+        return f"Current date: {self.current_date}"
+
+    def log_prefix_reuse(self, tokens: list[int]):
+        # reports how much of this prompt could be served from a provider / KV prefix cache
+        shared = 0
+        for a, b in zip(self._last_prompt_tokens, tokens):
+            if a != b:
+                break
+            shared += 1
+
+        self.prefix_stats = (shared, len(tokens))
+        self._last_prompt_tokens = tokens
+        logger.debug(f"Prompt prefix: {shared}/{len(tokens)} tokens shared with the previous request ({round(shared / max(len(tokens), 1) * 100)}%)")
+
+    def completion_cache_key(self, model: str, params: dict, prompt: Union[str, list[dict]]) -> Union[str, None]:
+        # only deterministic completions can be cached
+        if not self.config.llm_cache_enabled or self.config.llm_temperature > 0:
+            return None
+        payload = json.dumps([type(self).__name__, model, params, prompt], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_cached_completion(self, cache_key: Union[str, None]) -> Union[str, None]:
+        if cache_key is None:
+            return None
+        response = self.db.get_cached_completion(cache_key, self.config.llm_cache_ttl)
+        if response is not None:
+            logger.debug(f"Completion cache hit ({cache_key[:12]})")
+        return response
+
+    def cache_completion(self, cache_key: Union[str, None], response: str):
+        if cache_key is None:
+            return
+        self.db.cache_completion(cache_key, response, self.config.llm_cache_max_entries)
+
     @property
     def is_openai(self) -> bool:
         return False
@@ -55,4 +169,19 @@ class LLMSource:
         return "Unknown LLM"
 
     def on_config_reloaded(self):
-        pass
\ No newline at end of file
+        pass
+
+    async def load(self):
+        # waits until the source can serve requests
+        pass
+
+    async def warmup(self):
+        # runs a dummy input through the model so the first real request doesn't pay for first-run overhead
+        pass
+
+    async def unload(self):
+        pass
+
+    @property
+    def busy(self) -> bool:
+        return False
\ No newline at end of file
@@ -2,52 +2,236 @@ from . import LLMSource
 from llmchat.config import Config
 from llmchat.persistence import PersistentData
 from llmchat.logger import logger
+from llmchat.latency import Deadline
+from llmchat.model_lifecycle import LifecycleEntry
 import discord
+import asyncio
 import os
 from langchain.llms import LlamaCpp
+from .llama_pool import LlamaModelPool
+from .llama_kv import LlamaStateCache, completion_tokens
+from .llama_tune import load_profile
+from .llama_worker import LlamaInferenceWorker, InferenceJob, PRIORITY_VOICE, PRIORITY_TEXT, PRIORITY_BACKGROUND
 import functools
 import time
+from contextlib import contextmanager, nullcontext
+
+class LlamaLifecycle(LifecycleEntry):
+    # lets the model lifecycle manager unload the resident LLaMA models, they're loaded again on the next request
+    name = "llama"
+
+    def __init__(self, llama: "LLaMA"):
+        self.llama = llama
+        self.last_used = time.time()
+        self.evictions = 0
+
+    @property
+    def loaded(self) -> bool:
+        return len(self.llama.pool.models) > 0
+
+    @property
+    def rss(self) -> int:
+        return self.llama.pool.total_size
+
+    @property
+    def in_use(self) -> int:
+        return self.llama.in_flight
+
+    def unload(self) -> bool:
+        # called from the lifecycle thread, the pool is only touched on the event loop
+        if not self.loaded or self.in_use or self.llama.loading_model_name:
+            return False
+        self.llama.client.loop.call_soon_threadsafe(self.llama.unload_models)
+        return True
+
 
 class LLaMA(LLMSource):
     model: LlamaCpp = None
+    model_name: str = None  # name of the model that is currently serving
+    loading_model_name: str = None
+
     def __init__(self, client: discord.Client, config: Config, db: PersistentData):
         super(LLaMA, self).__init__(client, config, db)
+        self._load_started = 0.0
+        self._loading: dict[str, asyncio.Task] = {}
+        self._load_lock = asyncio.Lock()
+        self.kv_cache = LlamaStateCache(self.config.llama_kv_cache_states)
+        self.worker = LlamaInferenceWorker(self.client.loop)
+        self.pool = LlamaModelPool(self.config.llama_pool_memory_budget_mb, on_evict=self.kv_cache.forget_model)
+        self.in_flight = 0
+        self.lifecycle = LlamaLifecycle(self)
+        self.client.lifecycle.register(self.lifecycle)
         self.load_model()
 
-    def load_model(self):
-        if len(self.config.llama_model_name) == 0:
-            logger.warn(
-                "No LLaMA model specified: 'LLaMA.model_name' is blank. Choose a model with /model"
-            )
-            return
-
-        model_path = os.path.join(
-            self.config.llama_search_path, self.config.llama_model_name
-        )
+    def _build_model(self, model_name: str) -> LlamaCpp:
+        # blocking, runs in an executor
+        model_path = os.path.join(self.config.llama_search_path, model_name)
         if not os.path.exists(model_path):
-            logger.warn("LLaMA model", model_path, "doesn't exist!")
-            return
+            raise Exception(f"LLaMA model {model_path} doesn't exist!")
+
+        # runtime profile from `python main.py llama tune`
+        profile = load_profile(model_name) or {}
+        if profile:
+            logger.info(f"Using tuned profile for {model_name}: {profile['n_threads']} threads, batch size {profile['n_batch']}")
 
-        self.model = LlamaCpp(
+        return LlamaCpp(
             model_path=model_path,
-            n_ctx=2048,
+            n_ctx=profile.get("n_ctx", 2048),
+            n_threads=profile.get("n_threads"),
+            n_batch=profile.get("n_batch", 8),
+            use_mlock=profile.get("use_mlock", False),
             max_tokens=self.config.llm_max_tokens or 256,
             temperature=self.config.llm_temperature,
             repeat_penalty=self.config.llm_frequency_penalty,  # ~1.1 is a good value
+            use_mmap=self.config.llama_use_mmap,
         )
         # f16_kv is half precision, n_ctx is context window
 
+    def load_model(self, model_name: str = None, make_default: bool = True) -> asyncio.Task:
+        # loads the model in the background, the previous model keeps serving until the new one is ready
+        model_name = model_name or self.config.llama_model_name
+        if len(model_name) == 0:
+            logger.warn(
+                "No LLaMA model specified: 'LLaMA.model_name' is blank. Choose a model with /model"
+            )
+            return None
+
+        resident = self.pool.get(model_name)
+        if resident is not None:
+            if make_default:
+                logger.info(f"LLaMA model {model_name} is already resident, switching")
+                self.loading_model_name = None
+                self._swap(resident, model_name)
+            return None
+
+        if make_default:
+            # if another model is still loading, the latest requested one becomes the default
+            self.loading_model_name = model_name
+            self._load_started = time.time()
+
+        if model_name not in self._loading:
+            self._loading[model_name] = self.client.loop.create_task(self._load_in_background(model_name))
+        return self._loading[model_name]
+
+    def _swap(self, model: LlamaCpp, model_name: str):
+        self.model, self.model_name = model, model_name
+        self.pool.trim(self.protected_models)
+
+    async def load(self):
+        task = self._loading.get(self.loading_model_name) if self.loading_model_name else None
+        if task is not None:
+            await task
+
+    async def warmup(self):
+        model, model_name = self.model, self.model_name
+        if model is None:
+            return
+        prefix = self.get_initial().strip() + "\n"
+
+        def _warmup(job: InferenceJob):
+            # pages the weights in & allocates llama.cpp's buffers
+            self.kv_cache.deactivate(model.client, model_name)
+            with self._use_cpu_budget(model):
+                model.client.reset()
+                model.client.eval(completion_tokens(model.client, prefix))
+
+        await self.worker.run(_warmup, PRIORITY_BACKGROUND)
+
+    async def unload(self):
+        self.worker.stop()
+        self.unload_models()
+        if self.client.lifecycle.entries.get("llama") is self.lifecycle:
+            self.client.lifecycle.unregister("llama")
+
+    @property
+    def busy(self) -> bool:
+        return self.in_flight > 0
+
+    def unload_models(self):
+        # model_name is kept so the next request loads it again
+        for name in list(self.pool.models.keys()):
+            self.pool.remove(name)
+            self.kv_cache.forget_model(name)
+        self.model = None
+
+    async def ensure_loaded(self):
+        # reloads the default model if the lifecycle manager unloaded it
+        if self.model is None and not self.loading_model_name and self.model_name:
+            logger.info(f"LLaMA model {self.model_name} was unloaded, loading it again")
+            task = self.load_model(self.model_name)
+            if task is not None:
+                await task
+
+    @property
+    def protected_models(self) -> list[str]:
+        return [n for n in [self.model_name, self.loading_model_name] if n]
+
+    async def _load_in_background(self, model_name: str):
+        progress_task = self.client.loop.create_task(self._report_load_progress()) if self.loading_model_name == model_name else None
+        try:
+            # only one model is read from disk at a time
+            async with self._load_lock:
+                if self.loading_model_name != model_name and model_name not in self.config.llama_channel_models.values():
+                    return  # no longer needed
+
+                logger.info(f"Loading LLaMA model {model_name} in the background...")
+                start_time = time.time()
+                model = await self.client.loop.run_in_executor(None, self._build_model, model_name)
+                size = os.path.getsize(os.path.join(self.config.llama_search_path, model_name))
+                self.pool.add(model_name, model, size, protected=self.protected_models)
+                logger.info(f"LLaMA model {model_name} loaded in {round(time.time() - start_time, 1)}s")
+
+            if self.loading_model_name == model_name:
+                self.loading_model_name = None
+                self._swap(model, model_name)
+        except Exception as e:
+            logger.error(f"Failed to load LLaMA model {model_name}: {str(e)}")
+            if self.loading_model_name == model_name:
+                self.loading_model_name = None
+        finally:
+            self._loading.pop(model_name, None)
+            if progress_task:
+                progress_task.cancel()
+                await self.client.change_presence(activity=discord.Game(name=self.current_model_name))
+
+    def model_for_channel(self, channel_id: int = None) -> tuple[LlamaCpp, str]:
+        pinned = self.config.llama_channel_models.get(channel_id)
+        if pinned and pinned != self.model_name:
+            model = self.pool.get(pinned)
+            if model is not None:
+                return model, pinned
+            self.load_model(pinned, make_default=False)
+            logger.info(f"{pinned} (pinned to channel {channel_id}) is loading, using {self.model_name} for now")
+        return self.model, self.model_name
+
+    async def _report_load_progress(self):
+        # discord rate limits presence updates, so only update every 10s
+        while True:
+            await self.client.change_presence(activity=discord.Game(name=self.current_model_name))
+            await asyncio.sleep(10)
+
     async def list_models(self) -> list[discord.SelectOption]:
         return [discord.SelectOption(label=f, value=f, default=self.config.llama_model_name == f) for f in os.listdir(self.config.llama_search_path)]
 
     def set_model(self, model_id: str) -> None:
         self.config.llama_model_name = model_id
-        self.load_model()
+        self.load_model(model_id)
 
-    async def get_context(self, invoker: discord.User = None):
+    async def get_context(self, invoker: discord.User = None, deadline: Deadline = None):
+        deadline = deadline or Deadline()
         context = self.get_initial(invoker).strip() + "\n"
+        summary = self.get_summary_text()
+        if summary:
+            context += summary + "\n"
+
+        context_count = self.config.llm_context_messages_count
+        if deadline.at_risk(self.config.latency_llm_reserve):
+            # only this reply goes without the older half, it stays in the history for the next request and is
+            # folded into the summary once it ages out of the full window
+            context_count = max(context_count // 2, 1)
+            deadline.degrade("context", f"shrinking context to {context_count} messages")
 
-        for i in self.db.get_recent_messages(self.config.llm_context_messages_count):
+        for i in self.db.get_recent_messages(context_count):
             author_id, content, message_id = i
             if author_id == -1:
                 continue
@@ -66,34 +250,133 @@ class LLaMA(LLMSource):
         if self.config.bot_reminder:
             context += f"Reminder: {self._insert_wildcards(self.config.bot_reminder, self.db.get_identity(invoker.id))}\n"
 
+        date_line = self.get_date_line()
+        if date_line:
+            context += date_line + "\n"
+
         context += f"{self.config.bot_name}: "
         return context
 
-    def _generate(self, context: str) -> str:
+    async def summarize(self, previous_summary: str, transcript: str) -> str:
+        model, model_name = self.model, self.model_name
+        if model is None:
+            raise Exception("Model not yet loaded!")
+        prompt = self.get_summary_prompt(previous_summary, transcript)
+
+        def _summarize(job: InferenceJob):
+            self.kv_cache.deactivate(model.client, model_name)
+            with self._use_cpu_budget(model):
+                return model(prompt, stop=["\n\n"])
+
+        self.in_flight += 1
+        try:
+            return await self.worker.run(_summarize, PRIORITY_BACKGROUND)
+        finally:
+            self.in_flight -= 1
+
+    def _use_cpu_budget(self, model: LlamaCpp):
+        # runs on the inference worker thread, limits llama.cpp to its share of the cores while other engines are busy
+        budget = getattr(self.client, "cpu_budget", None)
+        if budget is None:
+            return nullcontext()
+
+        @contextmanager
+        def _budgeted():
+            with budget.engine("llama") as threads:
+                # never more than the configured / tuned thread count
+                model.client.n_threads = min(threads, model.n_threads or threads)
+                yield
+        return _budgeted()
+
+    def _generate(self, job: InferenceJob, model: LlamaCpp, model_name: str, context: str, conversation: tuple = None, prefix: str = None, partial: list = None) -> str:
+        # runs on the inference worker thread
         ret = ""
         start_time = time.time()
-        for chunk in self.model.stream(context, stop=["\n"]):
-            ret += chunk["choices"][0]["text"]
-            logger.debug(ret)
+        if conversation is not None:
+            self.kv_cache.activate(model.client, model_name, conversation, prefix)
+        # tokenized here, the worker thread is the only one using the model
+        self.log_prefix_reuse(self.kv_cache.record_reuse(model.client, context, prefix if conversation is not None else None))
+
+        first_token_time = None
+        with self._use_cpu_budget(model):
+            for chunk in model.stream(context, stop=["\n"]):
+                if job.cancelled:
+                    raise Exception("Generation cancelled.")
+                job.tokens += 1
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                    logger.debug(f"Time to first token: {round(first_token_time, 2)}s")
+                ret += chunk["choices"][0]["text"]
+                if partial is not None:
+                    partial.append(chunk["choices"][0]["text"])
+                logger.debug(ret)
 
         logger.debug(f"Generation took {time.time() - start_time}s")
         if not len(ret):
             raise Exception("LLM generated an empty message!")
         return ret
 
-    async def generate_response(self, invoker: discord.User = None) -> str:
-        if self.model is None:
+    async def generate_response(self, invoker: discord.User = None, deadline: Deadline = None, channel_id: int = None, voice: bool = False) -> str:
+        self.lifecycle.last_used = time.time()
+        self.in_flight += 1
+        try:
+            return await self._generate_response(invoker, deadline, channel_id, voice)
+        finally:
+            self.in_flight -= 1
+            self.lifecycle.last_used = time.time()
+
+    async def _generate_response(self, invoker: discord.User, deadline: Deadline, channel_id: int, voice: bool) -> str:
+        await self.ensure_loaded()
+        # keep a reference so a model swap mid-generation doesn't affect this request
+        model, model_name = self.model_for_channel(channel_id)
+        if model is None:
+            if self.loading_model_name:
+                raise Exception(f"Model {self.loading_model_name} is still loading, try again in a bit!")
             raise Exception("Model not yet loaded! Use /model to load one.")
 
-        context = await self.get_context(invoker)
+        deadline = deadline or Deadline()
+        context = await self.get_context(invoker, deadline)
         logger.debug(context)
 
-        blocking = functools.partial(self._generate, context)
-        return await self.client.loop.run_in_executor(None, blocking)
+        cache_key = self.completion_cache_key(model_name, {
+            "max_tokens": model.max_tokens,
+            "temperature": model.temperature,
+            "repeat_penalty": model.repeat_penalty,
+        }, context)
+        cached = self.get_cached_completion(cache_key)
+        if cached is not None:
+            return cached
+
+        conversation = (channel_id, invoker.id if invoker else None) if self.config.llama_kv_cache_states > 0 else None
+        prefix = self.get_initial(invoker).strip() + "\n"
+        partial = []
+        blocking = functools.partial(self._generate, model=model, model_name=model_name, context=context, conversation=conversation, prefix=prefix, partial=partial)
+        try:
+            # the timeout cancels worker.run, which flags the job so the worker thread stops at the next token
+            response = await deadline.run("llm", self.worker.run(blocking, PRIORITY_VOICE if voice else PRIORITY_TEXT), minimum=self.config.latency_llm_reserve)
+        except asyncio.TimeoutError:
+            response = self.truncate_partial("".join(partial))
+            if not response:
+                raise Exception("LLaMA didn't generate anything in time!")
+            deadline.degrade("llm", f"replying with the first {len(partial)} tokens")
+            return response
+        self.cache_completion(cache_key, response)
+        return response
+
+    @staticmethod
+    def truncate_partial(text: str) -> str:
+        # cut an unfinished generation back to its last full sentence, if there is one
+        text = text.strip()
+        end = max(text.rfind(c) for c in ".!?")
+        return text[:end + 1] if end > 0 else text
 
 
     @property
     def current_model_name(self) -> str:
-        if len(self.config.llama_model_name) == 0:
+        if self.loading_model_name:
+            return f"Loading {self.loading_model_name}... ({round(time.time() - self._load_started)}s)"
+        if self.model_name is None:
             return "*Not loaded!*"
-        return self.config.llama_model_name
+        if self.model is None:
+            return f"{self.model_name} (unloaded)"
+        return self.model_name
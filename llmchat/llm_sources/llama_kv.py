@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from llmchat.logger import logger
+import hashlib
+import re
+
+
+def _prepends_space() -> bool:
+    # llama-cpp-python before 0.1.79 (GGML models) tokenized completion prompts as b" " + prompt
+    import llama_cpp
+    version = tuple([int(v) for v in re.findall(r"\d+", getattr(llama_cpp, "__version__", "0.2.0"))[:3]])
+    return version < (0, 1, 79)
+
+
+def completion_tokens(llama, text: str) -> list[int]:
+    # the tokens create_completion (and so LangChain's LlamaCpp) evaluates for a prompt, the KV cache only
+    # matches a saved state if it was built from exactly these
+    if _prepends_space():
+        return llama.tokenize(b" " + text.encode("utf-8"))
+    try:
+        return llama.tokenize(text.encode("utf-8"), special=True)
+    except TypeError:
+        return llama.tokenize(text.encode("utf-8"))
+
+
+def matching_prefix(llama, tokens: list[int]) -> int:
+    # how many of tokens are already evaluated in the model's KV cache
+    shared = 0
+    for a, b in zip(llama.eval_tokens, tokens):
+        if a != b:
+            break
+        shared += 1
+    return shared
+
+
+class LlamaStateCache:
+    # saved llama.cpp states (KV cache + evaluated tokens) so switching conversations doesn't re-evaluate the whole prompt.
+    # llama.cpp already reuses the longest matching token prefix of the state that is currently loaded,
+    # so a state only needs to be restored when the model switches to a different conversation.
+    def __init__(self, max_states: int):
+        self.max_states = max_states
+        self.states: OrderedDict[tuple, object] = OrderedDict()  # (model name, conversation) -> LlamaState
+        self.prefix_states: OrderedDict[tuple, object] = OrderedDict()  # (model name, prefix hash) -> LlamaState
+        self.active: dict[str, tuple] = {}  # model name -> conversation currently loaded in the model
+        self.reused_tokens = 0  # prompt tokens that were already in the KV cache
+        self.prompt_tokens = 0
+
+    @staticmethod
+    def _put(store: OrderedDict, key, state, max_states: int):
+        store[key] = state
+        store.move_to_end(key)
+        while len(store) > max_states:
+            store.popitem(last=False)
+
+    def activate(self, llama, model_name: str, conversation: tuple, prefix: str):
+        # blocking, must be called from the thread that owns the model
+        active = self.active.get(model_name)
+        if active == conversation:
+            return
+
+        if active is not None and self.max_states > 0:
+            self._put(self.states, (model_name, active), llama.save_state(), self.max_states)
+
+        state = self.states.get((model_name, conversation))
+        if state is not None:
+            self.states.move_to_end((model_name, conversation))
+            llama.load_state(state)
+            logger.debug(f"Restored llama.cpp state for conversation {conversation}")
+        else:
+            prefix_key = (model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+            prefix_state = self.prefix_states.get(prefix_key)
+            if prefix_state is not None:
+                llama.load_state(prefix_state)
+                logger.debug("Restored llama.cpp state for the initial prompt")
+            else:
+                # evaluate the static prefix once and keep it around for new conversations
+                llama.reset()
+                llama.eval(completion_tokens(llama, prefix))
+                self._put(self.prefix_states, prefix_key, llama.save_state(), max(self.max_states, 1))
+                logger.debug("Saved llama.cpp state for the initial prompt")
+
+        self.active[model_name] = conversation
+
+    def record_reuse(self, llama, prompt: str, prefix: str = None) -> list[int]:
+        # call right before the completion, so a state that doesn't match the prompt shows up in the log. returns the prompt tokens
+        tokens = completion_tokens(llama, prompt)
+        shared = matching_prefix(llama, tokens)
+        self.reused_tokens += shared
+        self.prompt_tokens += len(tokens)
+        prefix_tokens = len(completion_tokens(llama, prefix)) if prefix else 0
+        if shared < prefix_tokens:
+            logger.warn(f"llama.cpp state only matched {shared}/{prefix_tokens} tokens of the initial prompt, it's evaluated again")
+        else:
+            logger.debug(f"llama.cpp state matched {shared}/{len(tokens)} prompt tokens")
+        return tokens
+
+    def summary(self) -> str:
+        return f"KV cache reuse: {self.reused_tokens}/{self.prompt_tokens} prompt tokens ({round(self.reused_tokens / max(self.prompt_tokens, 1) * 100)}%)"
+
+    def deactivate(self, llama, model_name: str):
+        # call before using the model for something that isn't a conversation (e.g. summaries)
+        active = self.active.pop(model_name, None)
+        if active is not None and self.max_states > 0:
+            self._put(self.states, (model_name, active), llama.save_state(), self.max_states)
+
+    def forget_model(self, model_name: str):
+        for store in [self.states, self.prefix_states]:
+            for key in [k for k in store.keys() if k[0] == model_name]:
+                store.pop(key)
+        self.active.pop(model_name, None)
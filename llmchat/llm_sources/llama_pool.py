@@ -0,0 +1,47 @@
+from collections import OrderedDict
+from llmchat.logger import logger
+from langchain.llms import LlamaCpp
+from typing import Callable
+
+
+class LlamaModelPool:
+    # keeps recently used GGML models resident up to a memory budget, least recently used models are evicted first
+    def __init__(self, budget_mb: int, on_evict: Callable[[str], None] = None):
+        self.budget = budget_mb * 1024 * 1024
+        self.on_evict = on_evict
+        self.models: OrderedDict[str, tuple[LlamaCpp, int]] = OrderedDict()  # name -> (model, size in bytes)
+
+    @property
+    def total_size(self) -> int:
+        return sum([size for model, size in self.models.values()])
+
+    def get(self, name: str) -> LlamaCpp:
+        if name not in self.models:
+            return None
+        self.models.move_to_end(name)
+        return self.models[name][0]
+
+    def add(self, name: str, model: LlamaCpp, size: int, protected: list[str] = None):
+        self.models[name] = (model, size)
+        self.models.move_to_end(name)
+        self.trim((protected or []) + [name])
+
+    def remove(self, name: str):
+        self.models.pop(name, None)
+
+    def trim(self, protected: list[str]):
+        for name in list(self.models.keys()):
+            if self.total_size <= self.budget:
+                break
+            if name in protected:
+                continue
+            # in-flight requests hold their own reference, the model is freed once they finish
+            self.models.pop(name)
+            if self.on_evict:
+                self.on_evict(name)
+            logger.info(f"Evicted LLaMA model {name} from the pool ({round(self.total_size / 1024 / 1024)}MB resident)")
+
+    def summary(self) -> str:
+        if not self.models:
+            return "*No models resident.*"
+        return "\n".join([f"⚙️ {name} ({round(size / 1024 / 1024)}MB)" for name, (model, size) in reversed(self.models.items())])
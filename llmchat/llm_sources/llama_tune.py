@@ -0,0 +1,113 @@
+import json
+import os
+import socket
+import time
+from llmchat.config import Config
+from llmchat.logger import logger
+from .llama_kv import completion_tokens, matching_prefix
+
+PROFILES_PATH = "models/llama_profiles.json"
+TUNE_N_CTX = 2048
+TYPICAL_PROMPT_TOKENS = 1024  # used to weigh prompt eval against generation when picking the best profile
+TYPICAL_COMPLETION_TOKENS = 128
+BENCH_PROMPT = "The following is a long conversation between a helpful assistant and a curious user about the history of computing, " \
+               "starting with mechanical calculators, punched cards and vacuum tubes, and moving on to transistors, " \
+               "integrated circuits, personal computers, the internet and machine learning. " * 6
+
+
+def _profile_key(model_name: str) -> str:
+    return f"{model_name}@{socket.gethostname()}"
+
+
+def _load_profiles() -> dict:
+    if not os.path.exists(PROFILES_PATH):
+        return {}
+    with open(PROFILES_PATH, "r") as f:
+        return json.load(f)
+
+
+def load_profile(model_name: str) -> dict:
+    return _load_profiles().get(_profile_key(model_name))
+
+
+def save_profile(model_name: str, profile: dict):
+    profiles = _load_profiles()
+    profiles[_profile_key(model_name)] = profile
+    os.makedirs(os.path.dirname(PROFILES_PATH), exist_ok=True)
+    with open(PROFILES_PATH, "w") as f:
+        json.dump(profiles, f, indent=2)
+
+
+def _available_memory() -> int:
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _thread_grid() -> list[int]:
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return sorted(set([t for t in [1, 2, 4, 6, 8, 12, 16] if t <= cores] + [cores]))
+
+
+def _benchmark(llama, n_threads: int, n_batch: int) -> tuple[float, float]:
+    # llama.cpp reads n_threads / n_batch on every eval, so the model doesn't need to be reloaded per setting
+    llama.n_threads = n_threads
+    llama.n_batch = n_batch
+
+    tokens = completion_tokens(llama, BENCH_PROMPT)[:512]
+    llama.reset()
+    start_time = time.time()
+    llama.eval(tokens)
+    prompt_tps = len(tokens) / (time.time() - start_time)
+
+    # generate() continues from the evaluated tokens since they're exactly the ones passed in, so only generation is timed
+    if matching_prefix(llama, tokens) < len(tokens):
+        raise Exception("llama.cpp didn't keep the evaluated benchmark prompt")
+    generated = 0
+    start_time = time.time()
+    for token in llama.generate(tokens, top_k=40, top_p=0.95, temp=0.0, repeat_penalty=1.1):
+        generated += 1
+        if generated >= 32 or token == llama.token_eos():
+            break
+    generation_tps = generated / (time.time() - start_time)
+    return prompt_tps, generation_tps
+
+
+def tune(config: Config, model_name: str = None):
+    from llama_cpp import Llama
+
+    model_name = model_name or config.llama_model_name
+    model_path = os.path.join(config.llama_search_path, model_name)
+    if not os.path.exists(model_path):
+        raise Exception(f"LLaMA model {model_path} doesn't exist!")
+
+    logger.info(f"Tuning {model_name} on {socket.gethostname()}...")
+    llama = Llama(model_path=model_path, n_ctx=TUNE_N_CTX, use_mmap=True, verbose=False)
+
+    best, best_time = None, None
+    for n_threads in _thread_grid():
+        for n_batch in [8, 32, 128, 512]:
+            prompt_tps, generation_tps = _benchmark(llama, n_threads, n_batch)
+            reply_time = TYPICAL_PROMPT_TOKENS / prompt_tps + TYPICAL_COMPLETION_TOKENS / generation_tps
+            logger.info(f"n_threads={n_threads} n_batch={n_batch}: prompt {round(prompt_tps, 1)} tokens/s, "
+                        f"generation {round(generation_tps, 1)} tokens/s (~{round(reply_time, 1)}s per reply)")
+            if best_time is None or reply_time < best_time:
+                best_time = reply_time
+                best = {
+                    "n_threads": n_threads,
+                    "n_batch": n_batch,
+                    "prompt_tokens_per_second": round(prompt_tps, 2),
+                    "generation_tokens_per_second": round(generation_tps, 2),
+                }
+
+    # lock the model in RAM if it comfortably fits, so it never gets paged out
+    best["use_mlock"] = os.path.getsize(model_path) < _available_memory() / 2
+    best["n_ctx"] = TUNE_N_CTX
+    save_profile(model_name, best)
+    logger.info(f"Saved profile for {model_name}: {best}")
+    return best
@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from llmchat.logger import logger
+from typing import Callable, Any
+
+PRIORITY_VOICE = 0
+PRIORITY_TEXT = 1
+PRIORITY_BACKGROUND = 2
+
+
+class InferenceJob:
+    def __init__(self, fn: Callable[["InferenceJob"], Any], priority: int, future: asyncio.Future):
+        self.fn = fn
+        self.priority = priority
+        self.future = future
+        self.submitted_at = time.time()
+        self.cancelled = False
+        self.tokens = 0  # incremented by fn while generating
+
+
+class LlamaInferenceWorker:
+    # a single thread that owns every llama.cpp call, jobs are taken from a priority queue (voice before text)
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self.jobs_done = 0
+        self.total_queue_wait = 0.0
+        self.total_tokens = 0
+        self.total_generation_time = 0.0
+        self.stopped = False
+        self._lock = threading.Lock()  # jobs can't be queued after the worker drained its queue
+        self._thread = threading.Thread(target=self._run, name="llama-inference", daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def run(self, fn: Callable[[InferenceJob], Any], priority: int = PRIORITY_TEXT):
+        job = InferenceJob(fn, priority, self.loop.create_future())
+        with self._lock:
+            if self.stopped:
+                raise Exception("LLaMA was unloaded.")
+            self._queue.put((priority, next(self._seq), job))
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # skipped if still queued, stopped at the next token if running
+            job.cancelled = True
+            raise
+
+    def stop(self):
+        # the running job finishes, queued ones fail
+        with self._lock:
+            self.stopped = True
+            self._queue.put((-1, next(self._seq), None))
+
+    def _drain(self):
+        with self._lock:
+            while not self._queue.empty():
+                _, _, job = self._queue.get_nowait()
+                if job is not None:
+                    self.loop.call_soon_threadsafe(self._resolve, job, None, Exception("LLaMA was unloaded."))
+
+    def _resolve(self, job: InferenceJob, result=None, exception: BaseException = None):
+        if job.future.done():
+            return
+        if exception is not None:
+            job.future.set_exception(exception)
+        else:
+            job.future.set_result(result)
+
+    def _run(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                self._drain()
+                break
+            if job.cancelled:
+                logger.debug("Skipping cancelled LLaMA job")
+                continue
+
+            queue_wait = time.time() - job.submitted_at
+            start_time = time.time()
+            try:
+                result = job.fn(job)
+                self.loop.call_soon_threadsafe(self._resolve, job, result)
+            except BaseException as e:
+                self.loop.call_soon_threadsafe(self._resolve, job, None, e)
+
+            generation_time = time.time() - start_time
+            self.jobs_done += 1
+            self.total_queue_wait += queue_wait
+            self.total_tokens += job.tokens
+            self.total_generation_time += generation_time
+            logger.debug(f"LLaMA job (priority {job.priority}): waited {round(queue_wait, 2)}s in queue, "
+                         f"{job.tokens} tokens at {round(job.tokens / max(generation_time, 1e-6), 2)} tokens/s")
+
+    def summary(self) -> str:
+        if not self.jobs_done:
+            return "*No jobs yet.*"
+        return f"⚙️ Queue: {self.queue_depth} waiting, {round(self.total_queue_wait / self.jobs_done, 2)}s avg wait\n" \
+               f"⚙️ Speed: {round(self.total_tokens / max(self.total_generation_time, 1e-6), 2)} tokens/s"
@@ -2,11 +2,15 @@ from . import LLMSource
 from llmchat.config import Config
 from llmchat.persistence import PersistentData
 from llmchat.logger import logger
+from llmchat.latency import Deadline
+from .routing import ModelRouter
 import discord
+import asyncio
 import openai
 from aiohttp import ClientSession
 import tiktoken
 from typing import Union
+import time
 
 GPT_3_MAX_TOKENS = 2048
 GPT_4_MAX_TOKENS = 8192
@@ -16,6 +20,7 @@ class OpenAI(LLMSource):
     encoding: tiktoken.Encoding = None
     def __init__(self, client: discord.Client, config: Config, db: PersistentData):
         super(OpenAI, self).__init__(client, config, db)
+        self.router = ModelRouter(config, self.max_tokens_for)
         self.update_encoding()
         self.on_config_reloaded()
 
@@ -54,19 +59,27 @@ class OpenAI(LLMSource):
 
     @property
     def use_chat_completion(self):
-        return self.config.openai_model.startswith(
-            "gpt-4"
-        ) or self.config.openai_model.startswith("gpt-3.5")
+        return self.is_chat_model(self.config.openai_model)
 
-    def update_encoding(self):
-        encoder_name = self.config.openai_model
+    @staticmethod
+    def is_chat_model(model: str) -> bool:
+        return model.startswith("gpt-4") or model.startswith("gpt-3.5")
+
+    @staticmethod
+    def max_tokens_for(model: str) -> int:
+        if not OpenAI.is_chat_model(model):
+            return GPT_3_MAX_TOKENS
+        return GPT_4_MAX_TOKENS if "32k" not in model else GPT_4_32K_MAX_TOKENS
+
+    def update_encoding(self, model: str = None):
+        encoder_name = model or self.config.openai_model
 
         if not self.encoding or self.encoding.name != encoder_name:
-            logger.debug(f"Updating tokenizer encoding for {self.config.openai_model}")
+            logger.debug(f"Updating tokenizer encoding for {encoder_name}")
             try:
                 self.encoding = tiktoken.encoding_for_model(encoder_name)
             except KeyError as e:
-                logger.debug(f"Failed to get encoder for OpenAI model: {self.config.openai_model}. Using default (cl100k_base)")
+                logger.debug(f"Failed to get encoder for OpenAI model: {encoder_name}. Using default (cl100k_base)")
                 self.encoding = tiktoken.get_encoding("cl100k_base")
 
     def get_token_count(self, content: Union[str, list[dict], dict]) -> int:
@@ -87,16 +100,33 @@ class OpenAI(LLMSource):
             # wtf
             raise Exception(f"Can't get token count of unhandled type {type(content).__name__}")
 
+    def pick_model(self, deadline: Deadline, channel_id: int = None) -> str:
+        if self.router.enabled:
+            recent_messages = self.db.get_recent_messages(self.config.llm_context_messages_count)
+            last_message = recent_messages[-1][1] if recent_messages else ""
+            context_tokens = self.get_token_count(self.config.bot_initial_prompt + "".join([m[1] for m in recent_messages]))
+            return self.router.route(last_message, context_tokens, channel_id, deadline)
+
+        model = self.config.openai_model
+        fast_model = self.config.latency_fast_model
+        if fast_model and fast_model != model and deadline.at_risk(self.config.latency_llm_reserve):
+            deadline.degrade("llm", f"switching to {fast_model}")
+            model = fast_model
+        return model
+
     async def generate_response(
-        self, invoker: discord.User = None, _retry_count=0
+        self, invoker: discord.User = None, deadline: Deadline = None, channel_id: int = None, voice: bool = False, _retry_count=0, _model: str = None
     ) -> str:
+        deadline = deadline or Deadline()
+        model = _model or self.pick_model(deadline, channel_id)
+
         async with ClientSession() as s:
             openai.aiosession.set(s)
 
             try:
-                if not self.use_chat_completion:
+                if not self.is_chat_model(model):
                     completion_tokens = 400 if self.config.llm_max_tokens == 0 else self.config.llm_max_tokens
-                    prompt = await self.get_context_gpt3(invoker)
+                    prompt = await self.get_context_gpt3(invoker, model, deadline)
                     token_count = self.get_token_count(prompt)
 
                     if token_count + completion_tokens > GPT_3_MAX_TOKENS:
@@ -104,58 +134,131 @@ class OpenAI(LLMSource):
                         if completion_tokens < 0:
                             raise Exception(f"Token limit exceeded! ({token_count} > {GPT_3_MAX_TOKENS}) Please make your initial context shorter or reduce the message context count!")
 
-                    response = await openai.Completion.acreate(
-                        api_base=self.config.openai_reverse_proxy_url,
-                        model=self.config.openai_model,
-                        prompt=prompt,
+                    params = dict(
                         stop="\n",
                         max_tokens=completion_tokens,
                         temperature=self.config.llm_temperature,
                         presence_penalty=self.config.llm_presence_penalty,
                         frequency_penalty=self.config.llm_frequency_penalty,
                     )
+                    cache_key = self.completion_cache_key(model, params, prompt)
+                    cached = self.get_cached_completion(cache_key)
+                    if cached is not None:
+                        return cached
+
+                    start_time = time.time()
+                    response = await deadline.run("llm", openai.Completion.acreate(
+                        api_base=self.config.openai_reverse_proxy_url,
+                        model=model,
+                        prompt=prompt,
+                        **params,
+                    ), minimum=self.config.latency_llm_reserve)
+                    self.router.record(model, time.time() - start_time)
                     logger.debug(f"{response.usage.total_tokens} tokens used")
                     response = response.choices[0].text.strip()
                 else:
                     completion_tokens = self.config.llm_max_tokens
-                    messages = self.get_context_gpt4(invoker)
+                    messages = self.get_context_gpt4(invoker, model, deadline)
                     token_count = self.get_token_count(messages)
-                    model_max_tokens = GPT_4_MAX_TOKENS if "32k" not in self.config.openai_model else GPT_4_32K_MAX_TOKENS
+                    model_max_tokens = self.max_tokens_for(model)
 
                     if token_count + completion_tokens > model_max_tokens:
                         completion_tokens = model_max_tokens - token_count
                         if completion_tokens < 0:
                             raise Exception(f"Token limit exceeded! ({token_count} > {model_max_tokens}) Please make your initial context shorter or reduce the message context count!")
 
-                    response = await openai.ChatCompletion.acreate(
-                        api_base=self.config.openai_reverse_proxy_url,
-                        model=self.config.openai_model,
+                    params = dict(
                         max_tokens=None
                         if completion_tokens == 0
                         else completion_tokens,
-                        messages=messages,
                         temperature=self.config.llm_temperature,
                         presence_penalty=self.config.llm_presence_penalty,
                         frequency_penalty=self.config.llm_frequency_penalty,
                     )
+                    cache_key = self.completion_cache_key(model, params, messages)
+                    cached = self.get_cached_completion(cache_key)
+                    if cached is not None:
+                        return cached
+
+                    start_time = time.time()
+                    response = await deadline.run("llm", openai.ChatCompletion.acreate(
+                        api_base=self.config.openai_reverse_proxy_url,
+                        model=model,
+                        messages=messages,
+                        **params,
+                    ), minimum=self.config.latency_llm_reserve)
+                    self.router.record(model, time.time() - start_time)
                     logger.debug(f"{response.usage.total_tokens} tokens used")
                     response = response.choices[0].message.content.strip()
 
                 if not response:
                     raise Exception("Response from OpenAI API was empty!")
+                self.cache_completion(cache_key, response)
                 return response
             except openai.error.APIConnectionError as e:
                 # https://github.com/openai/openai-python/issues/371
                 if _retry_count == 3:
                     raise e
                 logger.warn(f"Connection reset error, Retrying ({_retry_count})...")
-                return await self.generate_response(_retry_count=_retry_count + 1)
+                return await self.generate_response(invoker, deadline, channel_id, voice, _retry_count=_retry_count + 1, _model=_model)
+            except asyncio.TimeoutError:
+                # the budget is spent now, so this picks the fast model / fastest tier if there is one
+                fast_model = self.pick_model(deadline, channel_id)
+                if fast_model == model:
+                    raise Exception(f"{model} didn't reply in time!")
+                logger.warn(f"{model} timed out, retrying with {fast_model}")
+                return await self.generate_response(invoker, deadline, channel_id, voice, _retry_count, _model=fast_model)
+
+    async def summarize(self, previous_summary: str, transcript: str) -> str:
+        prompt = self.get_summary_prompt(previous_summary, transcript)
+        async with ClientSession() as s:
+            openai.aiosession.set(s)
+            if self.use_chat_completion:
+                response = await openai.ChatCompletion.acreate(
+                    api_base=self.config.openai_reverse_proxy_url,
+                    model=self.config.openai_model,
+                    max_tokens=self.config.llm_summary_max_tokens,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0,
+                )
+                return response.choices[0].message.content
+            else:
+                response = await openai.Completion.acreate(
+                    api_base=self.config.openai_reverse_proxy_url,
+                    model=self.config.openai_model,
+                    prompt=prompt,
+                    max_tokens=self.config.llm_summary_max_tokens,
+                    temperature=0,
+                )
+                return response.choices[0].text
+
+    def context_window(self, deadline: Deadline) -> int:
+        count = self.config.llm_context_messages_count
+        if deadline.at_risk(self.config.latency_llm_reserve):
+            # only this reply goes without the older half, it stays in the history for the next request and is
+            # folded into the summary once it ages out of the full window
+            deadline.degrade("context", f"shrinking context to {max(count // 2, 1)} messages")
+            return max(count // 2, 1)
+        return count
+
+    def should_recall(self, deadline: Deadline) -> bool:
+        if not self.config.openai_use_embeddings:
+            return False
+        if deadline.at_risk(self.config.latency_recall_reserve):
+            deadline.degrade("recall", "skipping embedding recall")
+            return False
+        return True
 
-    async def get_context_gpt3(self, invoker: discord.User = None) -> str:
-        self.update_encoding()
+    async def get_context_gpt3(self, invoker: discord.User = None, model: str = None, deadline: Deadline = None) -> str:
+        deadline = deadline or Deadline()
+        self.update_encoding(model)
         context = self.get_initial(invoker).strip() + "\n"
+        summary = self.get_summary_text()
+        if summary:
+            context += summary + "\n"
         reminder = f"Reminder: {self._insert_wildcards(self.config.bot_reminder, self.db.get_identity(invoker.id))}\n" if self.config.bot_reminder else ""
-        end = reminder + f"{self.config.bot_name}: "
+        date_line = self.get_date_line()
+        end = reminder + (date_line + "\n" if date_line else "") + f"{self.config.bot_name}: "
 
         min_token_count = self.get_token_count(context + end)
         cur_token_count = min_token_count
@@ -163,12 +266,13 @@ class OpenAI(LLMSource):
         if cur_token_count > GPT_3_MAX_TOKENS:
             raise Exception(f"Please shorten your reminder / initial prompt. Max token count exceeded: {cur_token_count} > {GPT_3_MAX_TOKENS}")
 
+        context_count = self.context_window(deadline)
         all_messages = self.db.get_recent_messages()
-        recent_messages = all_messages[-self.config.llm_context_messages_count:]
-        ooc_messages = all_messages[:-self.config.llm_context_messages_count]  # everything but the messages in the context limit
+        recent_messages = all_messages[-context_count:]
+        ooc_messages = all_messages[:-context_count]  # everything but the messages in the context limit
 
         similar_messages = []
-        if self.config.openai_use_embeddings and ooc_messages:
+        if ooc_messages and self.should_recall(deadline):
             similar_matches = self.similar_messages(recent_messages[-1], ooc_messages)
             if similar_matches:
                 logger.debug("Bot will be reminded of:\n\t" + '\n\t'.join([f"{message[1]} ({round(similarity * 100)}% similar)" for message, similarity in similar_matches]))
@@ -177,22 +281,22 @@ class OpenAI(LLMSource):
                 similar_messages = list(messages)
                 similar_messages.sort(key=lambda m: m[2])
 
-        for i in similar_messages+recent_messages:
-            fmt_message = ""
-            author_id, content, message_id = i
+        async def format_message(message) -> str:
+            author_id, content, message_id = message
             if author_id == -1:
+                return ""
+            return f"{await self.get_author_name(author_id)}: {content}\n"
+
+        if self.config.llm_stable_prefix:
+            # recalled messages go to the tail so they don't change the prefix
+            history, memories = recent_messages, similar_messages
+        else:
+            history, memories = similar_messages + recent_messages, []
+
+        for i in history:
+            fmt_message = await format_message(i)
+            if not fmt_message:
                 continue
-            elif author_id == self.client.user.id:
-                fmt_message += f"{self.config.bot_name}: {content}"
-            else:
-                name = (await self.client.fetch_user(author_id)).display_name
-                identity = self.db.get_identity(author_id)
-                if identity is not None:
-                    name_, identity = identity
-                    name = name_
-
-                fmt_message += f"{name}: {content}"
-            fmt_message += "\n"
             token_count = self.get_token_count(fmt_message)
             if cur_token_count + token_count > GPT_3_MAX_TOKENS:
                 logger.warn(f"Maximum token count reached ({cur_token_count} + {token_count} > {GPT_3_MAX_TOKENS}). Context will be shorter than expected.")
@@ -201,9 +305,17 @@ class OpenAI(LLMSource):
                 context += fmt_message
                 cur_token_count += token_count
 
+        if memories:
+            memory_block = "Earlier messages you may recall:\n" + "".join([await format_message(m) for m in memories])
+            token_count = self.get_token_count(memory_block)
+            if cur_token_count + token_count <= GPT_3_MAX_TOKENS:
+                context += memory_block
+                cur_token_count += token_count
+
         context += end
         logger.debug(f"Calculated prompt token count: {cur_token_count}")
         logger.debug(f"Context: {context}")
+        self.log_prefix_reuse(self.encoding.encode(context))
         return context
 
     def similar_messages(self, last_message, messages_pool):
@@ -217,13 +329,28 @@ class OpenAI(LLMSource):
             logger.warn("Unable to find embedding for message " + last_message[2])
         return similar_matches
 
-    def get_context_gpt4(self, invoker: discord.User = None) -> list[dict]:
-        self.update_encoding()
+    def cached_author_name(self, author_id: int) -> str:
+        # get_author_name without fetching from discord, for building the context synchronously
+        if author_id == -1:
+            return "System"
+        if author_id == self.client.user.id:
+            return self.config.bot_name
+        identity = self.db.get_identity(author_id)
+        if identity is not None:
+            return identity[0]
+        user = self.client.get_user(author_id)
+        return user.display_name if user else "User"
+
+    def get_context_gpt4(self, invoker: discord.User = None, model: str = None, deadline: Deadline = None) -> list[dict]:
+        model = model or self.config.openai_model
+        deadline = deadline or Deadline()
+        self.update_encoding(model)
         initial = self.get_initial(invoker)
         reminder = f"Reminder: {self._insert_wildcards(self.config.bot_reminder, self.db.get_identity(invoker.id))}" if self.config.bot_reminder else ""
+        reminder = "\n".join(filter(None, [reminder, self.get_date_line()]))
 
         min_token_count = self.get_token_count(initial) + 4 + (self.get_token_count(reminder) + 4 if reminder else 0)
-        max_token_count = GPT_4_MAX_TOKENS if "32k" not in self.config.openai_model else GPT_4_32K_MAX_TOKENS
+        max_token_count = self.max_tokens_for(model)
         cur_token_count = min_token_count
 
         if cur_token_count > max_token_count:
@@ -241,12 +368,13 @@ class OpenAI(LLMSource):
 
             return {"role": role, "content": content}
 
+        context_count = self.context_window(deadline)
         all_messages = self.db.get_recent_messages()
-        recent_messages = all_messages[-self.config.llm_context_messages_count:]
-        ooc_messages = all_messages[:-self.config.llm_context_messages_count]  # everything but the messages in the context limit
+        recent_messages = all_messages[-context_count:]
+        ooc_messages = all_messages[:-context_count]  # everything but the messages in the context limit
 
         similar_messages = []
-        if self.config.openai_use_embeddings and ooc_messages:
+        if ooc_messages and self.should_recall(deadline):
             similar_matches = self.similar_messages(recent_messages[-1], ooc_messages)
             if similar_matches:
                 logger.debug("Bot will be reminded of:\n\t"+'\n\t'.join([f"{message[1]} ({round(similarity * 100)}% similar)" for message, similarity in similar_matches]))
@@ -257,7 +385,19 @@ class OpenAI(LLMSource):
 
         ret.append({"role": "system", "content": initial})
 
-        fmt_messages = list(map(format_message, similar_messages+recent_messages))
+        summary = self.get_summary_text()
+        if summary:
+            summary_message = {"role": "system", "content": summary}
+            ret.append(summary_message)
+            cur_token_count += self.get_token_count(summary_message)
+
+        if self.config.llm_stable_prefix:
+            # recalled messages go to the tail so they don't change the prefix
+            history, memories = recent_messages, similar_messages
+        else:
+            history, memories = similar_messages + recent_messages, []
+
+        fmt_messages = list(map(format_message, history))
 
         for m in fmt_messages:
             token_count = self.get_token_count(m)
@@ -268,6 +408,14 @@ class OpenAI(LLMSource):
                 ret.append(m)
                 cur_token_count += token_count
 
+        if memories:
+            memory_message = {"role": "system", "content": "Earlier messages you may recall:\n" + "\n".join(
+                [f"{self.cached_author_name(author_id)}: {content}" for author_id, content, _ in memories])}
+            token_count = self.get_token_count(memory_message)
+            if cur_token_count + token_count <= max_token_count:
+                ret.append(memory_message)
+                cur_token_count += token_count
+
         if reminder:
             ret.append({"role": "system", "content": reminder})
 
@@ -275,6 +423,7 @@ class OpenAI(LLMSource):
 
         logger.debug(f"Calculated prompt token count: {cur_token_count}")
         logger.debug(str(ret))
+        self.log_prefix_reuse(self.encoding.encode("".join([f"{m['role']}\n{m['content']}\n" for m in ret])))
         return ret
 
     @property
@@ -0,0 +1,53 @@
+from llmchat.config import Config
+from llmchat.latency import Deadline
+from llmchat.logger import logger
+from typing import Callable
+
+
+class ModelRouter:
+    # picks an OpenAI model from OpenAI.routing_tiers (fastest first) for each request
+    def __init__(self, config: Config, max_tokens_for: Callable[[str], int]):
+        self.config = config
+        self.max_tokens_for = max_tokens_for
+        self.tier_latency: dict[str, tuple[int, float]] = {}  # model -> (requests, total seconds)
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.config.openai_routing_tiers) > 0
+
+    def route(self, last_message: str, context_tokens: int, channel_id: int = None, deadline: Deadline = None) -> str:
+        tiers = self.config.openai_routing_tiers
+        tier = 0
+        reasons = []
+
+        if deadline and deadline.at_risk(self.config.latency_llm_reserve):
+            reasons.append("latency budget at risk")
+        else:
+            if channel_id in self.config.openai_routing_slow_channels:
+                tier = len(tiers) - 1
+                reasons.append("slow channel")
+            elif len(last_message) > self.config.openai_routing_short_message_chars:
+                tier = min(1, len(tiers) - 1)
+                reasons.append(f"long message ({len(last_message)} chars)")
+            else:
+                reasons.append("short message")
+
+        # slower tiers are only used when the context doesn't fit in the faster ones
+        completion_tokens = self.config.llm_max_tokens or 400
+        while tier < len(tiers) - 1 and context_tokens + completion_tokens > self.max_tokens_for(tiers[tier]):
+            tier += 1
+            reasons.append(f"context too long ({context_tokens} tokens)")
+
+        model = tiers[tier]
+        logger.info(f"Routing to {model} (tier {tier}): {', '.join(reasons)}")
+        return model
+
+    def record(self, model: str, seconds: float):
+        count, total = self.tier_latency.get(model, (0, 0.0))
+        self.tier_latency[model] = (count + 1, total + seconds)
+        logger.debug(f"{model} took {round(seconds, 2)}s (avg {round((total + seconds) / (count + 1), 2)}s over {count + 1} requests)")
+
+    def summary(self) -> str:
+        if not self.tier_latency:
+            return "*No requests yet.*"
+        return "\n".join([f"⚙️ {model}: {round(total / count, 2)}s avg ({count} requests)" for model, (count, total) in self.tier_latency.items()])
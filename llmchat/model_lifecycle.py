@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from contextlib import nullcontext
+from logger import logger
+from typing import Callable, Any
+
+
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+class LifecycleEntry:
+    # something the lifecycle manager can unload: a ManagedModel, or a source with its own loading logic (LLaMA)
+    name: str = ""
+    last_used: float = 0.0
+    rss: int = 0
+    in_use: int = 0
+    evictions: int = 0
+    is_remote = False  # see RemoteModel
+
+    @property
+    def loaded(self) -> bool:
+        return False
+
+    def unload(self) -> bool:
+        # returns False if the model couldn't be unloaded (e.g. in use)
+        return False
+
+
+class ManagedModel(LifecycleEntry):
+    # loads the model on first use and stands in for it, method calls are forwarded to the loaded model
+    def __init__(self, name: str, loader: Callable[[], Any], manager: "ModelLifecycleManager"):
+        self.name = name
+        self.loader = loader
+        self.manager = manager
+        self.last_used = time.time()
+        self.rss = 0
+        self.in_use = 0
+        self.evictions = 0
+        self._model = None
+        self._lock = threading.RLock()
+        self.cpu_budget = None  # set to a CpuBudget to limit the threads this model uses
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                start_time, rss_before = time.time(), current_rss()
+                self._model = self.loader()
+                self.rss = max(current_rss() - rss_before, 0)
+                logger.info(f"Loaded {self.name} in {round(time.time() - start_time, 1)}s (~{round(self.rss / 1024 / 1024)}MB)")
+            self.last_used = time.time()
+            model = self._model
+        self.manager.enforce_budget(protected=self)
+        return model
+
+    def unload(self) -> bool:
+        with self._lock:
+            if self._model is None or self.in_use:
+                return False
+            self._model = None
+            self.rss = 0
+        self.manager.release_memory()
+        return True
+
+    def _has_method(self, method: str) -> bool:
+        # looked up on the model class while it's unloaded, attribute lookups must never load it
+        if self._model is not None:
+            return callable(getattr(self._model, method, None))
+        model_type = getattr(self.loader, "func", self.loader)  # the class, or a partial of it
+        return callable(getattr(model_type, method, None)) if isinstance(model_type, type) else True
+
+    def __getattr__(self, method: str):
+        # only called for attributes ManagedModel doesn't have itself
+        if method.startswith("_") or not self._has_method(method):
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            with self._lock:
+                self.in_use += 1
+            try:
+                with self.cpu_budget.engine(self.name) if self.cpu_budget else nullcontext():
+                    return getattr(self.load(), method)(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.in_use -= 1
+                    self.last_used = time.time()
+        return call
+
+
+class ModelLifecycleManager:
+    # unloads models after idle_timeout seconds without use, or least recently used first when over budget_mb.
+    # 0 disables either check.
+    def __init__(self, idle_timeout: float = 0, budget_mb: int = 0):
+        self.idle_timeout = idle_timeout
+        self.budget = budget_mb * 1024 * 1024
+        self.entries: dict[str, LifecycleEntry] = {}
+        if self.idle_timeout > 0 or self.budget > 0:
+            threading.Thread(target=self._sweep_forever, name="model-lifecycle", daemon=True).start()
+
+    def manage(self, name: str, loader: Callable[[], Any], preload: bool = False) -> ManagedModel:
+        entry = ManagedModel(name, loader, self)
+        self.register(entry)
+        if preload:
+            entry.load()
+        return entry
+
+    def register(self, entry: LifecycleEntry):
+        self.entries[entry.name] = entry
+
+    def unregister(self, name: str):
+        self.entries.pop(name, None)
+
+    def release(self, entry: LifecycleEntry) -> bool:
+        # unloads an entry that's being replaced or disabled & stops tracking it. returns False if it's still in use,
+        # it stays registered then so it can be released again later
+        if entry.loaded and not entry.unload():
+            return False
+        if self.entries.get(entry.name) is entry:
+            self.unregister(entry.name)
+        return True
+
+    @property
+    def resident_size(self) -> int:
+        return sum([e.rss for e in self.entries.values() if e.loaded])
+
+    def _evict(self, entry: LifecycleEntry, reason: str):
+        if entry.unload():
+            entry.evictions += 1
+            logger.info(f"Unloaded {entry.name} ({reason})")
+
+    def enforce_budget(self, protected: LifecycleEntry = None):
+        if self.budget <= 0:
+            return
+        for entry in sorted(self.entries.values(), key=lambda e: e.last_used):
+            if self.resident_size <= self.budget:
+                break
+            if entry is protected or not entry.loaded:
+                continue
+            self._evict(entry, f"over the {round(self.budget / 1024 / 1024)}MB budget")
+
+    def sweep(self):
+        if self.idle_timeout > 0:
+            now = time.time()
+            for entry in list(self.entries.values()):
+                if entry.loaded and now - entry.last_used > self.idle_timeout:
+                    self._evict(entry, f"idle for {round(now - entry.last_used)}s")
+        self.enforce_budget()
+
+    def _sweep_forever(self):
+        interval = min([v for v in [self.idle_timeout / 4, 30] if v > 0])
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warn(f"Model lifecycle sweep failed: {str(e)}")
+
+    @staticmethod
+    def release_memory():
+        import gc
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def summary(self) -> str:
+        if not self.entries:
+            return "*No models.*"
+        now = time.time()
+        ret = []
+        for e in self.entries.values():
+            state = f"resident (~{round(e.rss / 1024 / 1024)}MB), idle {round(now - e.last_used)}s" if e.loaded else "unloaded"
+            ret.append(f"⚙️ {e.name}: {state}, {e.evictions} eviction(s)")
+        return "\n".join(ret)
@@ -0,0 +1,269 @@
+import asyncio
+import functools
+import importlib
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+from logger import logger
+from cpu_budget import apply_torch_threads
+from model_lifecycle import ModelLifecycleManager
+
+# models that can be hosted by the server, loaded on first use
+BACKENDS = {
+    "whisper": "sr_sources.whisper:WhisperModel",
+    "blip": "blip:BLIP",
+    "silero": "tts_sources.silero:SileroModel",
+    "bark": "tts_sources.bark:BarkModel",
+}
+
+# methods a RemoteModel forwards for each kind
+REMOTE_METHODS = {
+    "whisper": {"load", "warmup", "transcribe", "transcribe_batch"},
+    "blip": {"load", "warmup", "process_image"},
+    "silero": {"load", "warmup", "synthesize"},
+    "bark": {"load", "warmup", "synthesize"},
+}
+
+
+def _backend_class(kind: str):
+    module_name, class_name = BACKENDS[kind].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _run_calls(kind: str, method: str, calls: list, lifecycle: ModelLifecycleManager, options: dict, settings: dict, send):
+    # calls: (request_id, args) of consecutive requests for the same method
+    try:
+        if settings["torch_threads"]:
+            # re-applied every batch since torch is only imported once a model loads
+            apply_torch_threads(settings["torch_threads"])
+        if kind not in lifecycle.entries:
+            lifecycle.manage(kind, functools.partial(_backend_class(kind), **options))
+        # unloaded after idle_timeout, loaded again on the next call
+        model = lifecycle.entries[kind]
+
+        if method == "load":
+            model.load()
+            for request_id, _ in calls:
+                send((request_id, True, None))
+            return
+
+        if len(calls) > 1 and hasattr(model, method + "_batch"):
+            results = getattr(model, method + "_batch")([args for _, args in calls])
+            for (request_id, _), result in zip(calls, results):
+                send((request_id, True, result))
+            return
+
+        for request_id, args in calls:
+            try:
+                send((request_id, True, getattr(model, method)(*args)))
+            except Exception as e:
+                send((request_id, False, f"{type(e).__name__}: {str(e)}"))
+    except Exception as e:
+        for request_id, _ in calls:
+            send((request_id, False, f"{type(e).__name__}: {str(e)}"))
+
+
+def _serve_kind(kind: str, requests: queue.Queue, lifecycle: ModelLifecycleManager, settings: dict, send):
+    # runs on the model server's thread for `kind`, requests are handled in the order they were sent
+    options = {}  # loader options
+    while True:
+        pending = [requests.get()]
+        # everything that queued up while the last batch ran is handled together
+        while True:
+            try:
+                pending.append(requests.get_nowait())
+            except queue.Empty:
+                break
+
+        calls, calls_method = [], None
+        for request in pending:
+            if request is None:
+                return
+            request_id, _, method, args = request
+            if calls and method != calls_method:
+                _run_calls(kind, calls_method, calls, lifecycle, options, settings, send)
+                calls = []
+
+            if method == "unload":
+                if kind in lifecycle.entries:
+                    lifecycle.entries[kind].unload()
+                send((request_id, True, None))
+            elif method == "configure":
+                if options != args[0] and kind in lifecycle.entries:
+                    # loaded with other options, the next call loads it again
+                    lifecycle.entries[kind].unload()
+                    lifecycle.unregister(kind)
+                options = args[0]
+                send((request_id, True, None))
+            else:
+                calls.append((request_id, args))
+                calls_method = method
+        if calls:
+            _run_calls(kind, calls_method, calls, lifecycle, options, settings, send)
+
+
+def _serve(conn, idle_timeout: float = 0, budget_mb: int = 0):
+    # runs in the model server process. every kind gets its own thread, so a long Bark synthesis doesn't hold up
+    # Whisper or BLIP (torch releases the GIL while it computes)
+    lifecycle = ModelLifecycleManager(idle_timeout, budget_mb)
+    settings = {"torch_threads": 0}  # from the bot's CPU budget, 0 to leave torch's default
+    queues: dict[str, queue.Queue] = {}
+    send_lock = threading.Lock()
+
+    def send(response):
+        with send_lock:
+            conn.send(response)
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        request_id, kind, method, args = request
+        if method == "status":
+            send((request_id, True, lifecycle.summary()))
+            continue
+        if method == "threads":
+            settings["torch_threads"] = args[0]
+            send((request_id, True, None))
+            continue
+        if kind not in queues:
+            queues[kind] = queue.Queue()
+            threading.Thread(target=_serve_kind, args=(kind, queues[kind], lifecycle, settings, send), name=f"model-server-{kind}", daemon=True).start()
+        queues[kind].put(request)
+
+    for requests in queues.values():
+        requests.put(None)
+
+
+class RemoteModel:
+    # stands in for a local model object, method calls are forwarded to the model server (blocking)
+    is_remote = True
+
+    def __init__(self, server: "ModelServer", kind: str):
+        self.server = server
+        self.kind = kind
+        self.cpu_budget = None  # set to a CpuBudget to count this model as active while calls run
+        self.in_use = 0
+
+    def __getattr__(self, method: str):
+        # only the model's methods are forwarded, attribute reads & introspection probes aren't
+        if method.startswith("_") or method not in REMOTE_METHODS.get(self.__dict__.get("kind"), set()):
+            raise AttributeError(method)
+
+        def call(*args):
+            self.in_use += 1
+            try:
+                with self.cpu_budget.engine(self.kind) if self.cpu_budget else nullcontext():
+                    return self.server.call(self.kind, method, *args)
+            finally:
+                self.in_use -= 1
+        return call
+
+    def unload(self):
+        self.server.call(self.kind, "unload")
+
+
+class ModelServer:
+    # hosts Whisper / BLIP / Silero / Bark in a separate process so torch doesn't share the GIL with the gateway
+    def __init__(self, idle_timeout: float = 0, budget_mb: int = 0):
+        self.idle_timeout = idle_timeout
+        self.budget_mb = budget_mb
+        self._ctx = multiprocessing.get_context("spawn")
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending: dict[int, Future] = {}
+        self._options: dict[str, dict] = {}  # kind -> loader options, sent again when the server restarts
+        self._process = None
+        self._conn = None
+        self.start()
+
+    def start(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_serve, args=(child_conn, self.idle_timeout, self.budget_mb), name="llmchat-model-server", daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        threading.Thread(target=self._receive, args=(parent_conn,), name="model-server-receiver", daemon=True).start()
+        logger.info(f"Model server started (pid {self._process.pid})")
+        for kind, options in self._options.items():
+            self._send(kind, "configure", options)
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(5)
+        if self._conn is not None:
+            self._conn.close()
+        self._fail_pending("Model server stopped")
+
+    def restart(self):
+        logger.info("Restarting model server...")
+        self.stop()
+        self.start()
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def model(self, kind: str, **options) -> RemoteModel:
+        if options:
+            # requests are handled in order, so calls made after this already use the options
+            self._options[kind] = options
+            self.submit(kind, "configure", options)
+        return RemoteModel(self, kind)
+
+    def set_torch_threads(self, threads: int):
+        # CpuBudget listener, doesn't wait for the server
+        self.submit("", "threads", threads)
+
+    def _fail_pending(self, reason: str):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(Exception(reason))
+
+    def _receive(self, conn):
+        while True:
+            try:
+                request_id, ok, result = conn.recv()
+            except (EOFError, OSError):
+                if conn is self._conn:
+                    self._fail_pending("Model server exited")
+                return
+
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(Exception(f"Model server: {result}"))
+
+    def submit(self, kind: str, method: str, *args) -> Future:
+        with self._send_lock:
+            if not self.alive:
+                logger.warn("Model server isn't running, restarting it")
+                self.start()
+            return self._send(kind, method, *args)
+
+    def _send(self, kind: str, method: str, *args) -> Future:
+        request_id = next(self._ids)
+        future = Future()
+        self._pending[request_id] = future
+        self._conn.send((request_id, kind, method, args))
+        return future
+
+    def call(self, kind: str, method: str, *args):
+        start_time = time.time()
+        result = self.submit(kind, method, *args).result()
+        logger.debug(f"Model server: {kind}.{method} took {round(time.time() - start_time, 2)}s")
+        return result
+
+    async def acall(self, kind: str, method: str, *args):
+        return await asyncio.wrap_future(self.submit(kind, method, *args))
@@ -1,5 +1,7 @@
 import sqlite3
+import time
 import discord
+from typing import Union
 from scipy import spatial
 
 
@@ -38,6 +40,25 @@ class PersistentData:
         content TEXT,
         message_id INTEGER
     )
+    """
+        )
+        self.cursor.execute(
+            """
+    CREATE TABLE IF NOT EXISTS completion_cache (
+        cache_key TEXT PRIMARY KEY,
+        response TEXT,
+        created_at REAL,
+        last_used REAL
+    )
+    """
+        )
+        self.cursor.execute(
+            """
+    CREATE TABLE IF NOT EXISTS conversation_summary (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        summary TEXT,
+        summarized_until INTEGER
+    )
     """
         )
         self.connection.commit()
@@ -45,6 +66,7 @@ class PersistentData:
     def clear(self):
         self.cursor.execute("DELETE FROM message_history")
         self.cursor.execute("DELETE FROM message_embeddings")
+        self.cursor.execute("DELETE FROM conversation_summary")
         self.connection.commit()
         self.create_table()
 
@@ -55,11 +77,12 @@ class PersistentData:
         )
         self.connection.commit()
 
-    def speech(self, author: discord.User, content: str):
+    def speech(self, author: discord.User, content: str) -> int:
         self.cursor.execute(
             "INSERT INTO message_history VALUES (?, ?, ?)", (author.id, content, -1)
         )
         self.connection.commit()
+        return self.cursor.lastrowid
 
     def system(self, content: str, message_id: int):
         self.cursor.execute(
@@ -74,6 +97,13 @@ class PersistentData:
         self.remove_embedding(message_id)
         self.connection.commit()
 
+    def remove_row(self, rowid: int):
+        # speech has no message id
+        self.cursor.execute(
+            "DELETE FROM message_history WHERE ROWID = ?", (rowid,)
+        )
+        self.connection.commit()
+
     def remove_embedding(self, message_id: int):
         self.cursor.execute(
             "DELETE FROM message_embeddings WHERE message_id = ?", (message_id,)
@@ -117,6 +147,29 @@ class PersistentData:
         rows.reverse()
         return rows
 
+    def get_summary(self) -> tuple[str, int]:
+        self.cursor.execute(
+            "SELECT summary, summarized_until FROM conversation_summary WHERE id = 0"
+        )
+        return self.cursor.fetchone() or ("", 0)
+
+    def set_summary(self, summary: str, summarized_until: int):
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO conversation_summary (id, summary, summarized_until) VALUES (0, ?, ?)",
+            (summary, summarized_until),
+        )
+        self.connection.commit()
+
+    def get_unsummarized_messages(self, keep_recent: int) -> list[tuple[int, int, str, int]]:
+        # messages that have aged out of the context window but haven't been folded into the summary yet
+        _, summarized_until = self.get_summary()
+        self.cursor.execute(
+            "SELECT ROWID, author_id, content, message_id FROM message_history WHERE ROWID > ? AND ROWID NOT IN "
+            "(SELECT ROWID FROM message_history ORDER BY ROWID DESC LIMIT ?) ORDER BY ROWID",
+            (summarized_until, keep_recent),
+        )
+        return self.cursor.fetchall()
+
     def edit(self, message_id: int, new_content: str):
         self.cursor.execute(
             "UPDATE message_history SET content = ? WHERE message_id = ?",
@@ -186,3 +239,38 @@ class PersistentData:
         # sort based on similarity
         all_embeddings.sort(key=lambda x: x[1], reverse=True)
         return all_embeddings
+
+    def get_cached_completion(self, cache_key: str, ttl: float) -> Union[str, None]:
+        now = time.time()
+        self.cursor.execute(
+            "SELECT response, created_at FROM completion_cache WHERE cache_key = ?", (cache_key,)
+        )
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+
+        response, created_at = row
+        if ttl and now - created_at > ttl:
+            self.cursor.execute("DELETE FROM completion_cache WHERE cache_key = ?", (cache_key,))
+            self.connection.commit()
+            return None
+
+        self.cursor.execute(
+            "UPDATE completion_cache SET last_used = ? WHERE cache_key = ?", (now, cache_key)
+        )
+        self.connection.commit()
+        return response
+
+    def cache_completion(self, cache_key: str, response: str, max_entries: int):
+        now = time.time()
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO completion_cache (cache_key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+            (cache_key, response, now, now),
+        )
+        if max_entries > 0:
+            # evict least recently used entries
+            self.cursor.execute(
+                "DELETE FROM completion_cache WHERE cache_key NOT IN (SELECT cache_key FROM completion_cache ORDER BY last_used DESC LIMIT ?)",
+                (max_entries,),
+            )
+        self.connection.commit()
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable
+import numpy as np
+from logger import logger
+
+OVERFLOW_POLICIES = ["merge", "drop_oldest", "drop_newest"]
+
+
+class RecognitionJob:
+    def __init__(self, user_id: int, audio: np.ndarray, release: Callable[[], None] = None,
+                 result: Future = None, segments: list[Future] = None, speculation: int = None):
+        self.user_id = user_id
+        self.audio = audio
+        self.release = release  # frees the buffer region audio is a view of
+        self.result = result  # set for a segment of an utterance that's still going on, gets its transcript
+        self.segments = segments or []  # transcripts of the earlier segments of this utterance
+        self.speculation = speculation  # set for a tentative transcript, the speculation attempt it's for
+        self.queued_at = time.time()
+
+    @property
+    def mergeable(self) -> bool:
+        # segments are put together in order by the final job, they can't be merged into something else
+        return self.result is None and not self.segments and self.speculation is None
+
+    def done(self):
+        if self.release:
+            self.release()
+            self.release = None
+        if self.result and not self.result.done():
+            # dropped or failed, the rest of the utterance is still recognized
+            self.result.set_result(None)
+
+
+class RecognitionPool:
+    # a few recognition threads behind a bounded queue. when it's full, queued utterances from the same speaker are
+    # merged (merge) or the oldest / newest utterance is dropped. utterances that waited longer than max_age are dropped.
+    def __init__(self, recognize: Callable[[RecognitionJob], None], workers: int = 2, max_queue: int = 8,
+                 policy: str = "merge", max_age: float = 10.0):
+        if policy not in OVERFLOW_POLICIES:
+            raise Exception(f"Unknown recognition overflow policy {policy}, use one of {', '.join(OVERFLOW_POLICIES)}")
+        self.recognize = recognize
+        self.max_queue = max(max_queue, 1)
+        self.policy = policy
+        self.max_age = max_age
+        self.queue: deque[RecognitionJob] = deque()
+        self.submitted = 0
+        self.merged = 0
+        self.dropped = 0
+        self.closed = False
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._run, name=f"speech-recognition-{i}", daemon=True) for i in range(max(workers, 1))]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+    def _drop(self, job: RecognitionJob, reason: str):
+        self.dropped += 1
+        job.done()
+        logger.warn(f"Dropped an utterance from {job.user_id} ({reason})")
+
+    def _merge(self, job: RecognitionJob) -> bool:
+        # appends the audio to the speaker's queued utterance, they're recognized as one
+        for queued in self.queue:
+            if queued.user_id == job.user_id and queued.mergeable and job.mergeable:
+                queued.audio = np.concatenate([queued.audio, job.audio])
+                queued.done()
+                job.done()
+                self.merged += 1
+                return True
+        return False
+
+    def submit(self, job: RecognitionJob):
+        with self._cond:
+            if self.closed:
+                job.done()
+                return
+            self.submitted += 1
+            if len(self.queue) >= self.max_queue:
+                if self.policy == "merge" and self._merge(job):
+                    return
+                if self.policy == "drop_newest":
+                    self._drop(job, "recognition queue is full")
+                    return
+                self._drop(self.queue.popleft(), "recognition queue is full")
+            self.queue.append(job)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.queue and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return
+                job = self.queue.popleft()
+            try:
+                if time.time() - job.queued_at > self.max_age:
+                    self._drop(job, f"waited more than {self.max_age}s")
+                    continue
+                self.recognize(job)
+            except Exception as e:
+                logger.warn(f"Exception thrown while processing audio. {str(e)}")
+            finally:
+                job.done()
+
+    def shutdown(self):
+        with self._cond:
+            self.closed = True
+            for job in self.queue:
+                job.done()
+            self.queue.clear()
+            self._cond.notify_all()
+
+    def summary(self) -> str:
+        return f"Queue: {self.queue_depth}/{self.max_queue}, {self.submitted} submitted, {self.merged} merged, {self.dropped} dropped"
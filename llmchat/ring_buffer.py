@@ -0,0 +1,81 @@
+import threading
+import numpy as np
+
+
+class AudioRingBuffer:
+    # preallocated int16 buffer that utterances are written into back to back. take() hands out a view of the
+    # finished utterance instead of a copy, the region isn't written over until the view is released.
+    def __init__(self, capacity: int, channels: int, max_capacity: int = None):
+        self.channels = channels
+        self.max_capacity = max_capacity or capacity
+        self.data = np.zeros(shape=(capacity, channels), dtype='int16')
+        self.start = 0  # first sample of the utterance being recorded
+        self.end = 0
+        self.allocations = 1
+        self.copies = 0
+        self._leases: dict[int, tuple[np.ndarray, int, int]] = {}  # id -> (array, start, end)
+        self._next_lease = 0
+        self._lock = threading.Lock()
+        self._free_until = capacity  # can be written up to here without touching a leased region (only ever stale low)
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def capacity(self) -> int:
+        return len(self.data)
+
+    @property
+    def full(self) -> bool:
+        return len(self) >= self.max_capacity
+
+    def _leased(self, start: int, end: int) -> bool:
+        return any([a is self.data and s < end and start < e for a, s, e in self._leases.values()])
+
+    def _update_free_until(self):
+        with self._lock:
+            ahead = [s for a, s, e in self._leases.values() if a is self.data and s >= self.end]
+        self._free_until = min(ahead + [self.capacity])
+
+    def _make_room(self, samples: int):
+        # the utterance has to stay contiguous, move it to the front or into a bigger buffer
+        length = len(self) + samples
+        with self._lock:
+            if length <= self.capacity and not self._leased(0, length):
+                if len(self):
+                    self.data[:len(self)] = self.data[self.start:self.end]
+                    self.copies += 1
+            else:
+                # leased views keep the old array alive until they're released
+                data = np.empty(shape=(min(max(self.capacity, length * 2), max(self.max_capacity, length)), self.channels), dtype='int16')
+                data[:len(self)] = self.data[self.start:self.end]
+                self.data = data
+                self.allocations += 1
+        self.start, self.end = 0, length - samples
+        self._update_free_until()
+
+    def append(self, frame: np.ndarray) -> bool:
+        # returns False once the utterance is max_capacity samples long, take() it first
+        if len(self) + len(frame) > self.max_capacity:
+            return False
+        if self.end + len(frame) > self._free_until:
+            self._update_free_until()
+            if self.end + len(frame) > self._free_until:
+                self._make_room(len(frame))
+        self.data[self.end:self.end + len(frame)] = frame
+        self.end += len(frame)
+        return True
+
+    def take(self) -> tuple[np.ndarray, int]:
+        # returns a view of the utterance & a lease to release() once it's no longer needed
+        with self._lock:
+            lease = self._next_lease
+            self._next_lease += 1
+            self._leases[lease] = (self.data, self.start, self.end)
+        view = self.data[self.start:self.end]
+        self.start = self.end
+        return view, lease
+
+    def release(self, lease: int):
+        with self._lock:
+            self._leases.pop(lease, None)
@@ -0,0 +1,76 @@
+import asyncio
+from typing import Awaitable, Callable, Union
+import discord
+from logger import logger
+from persistence import PersistentData
+
+
+class SpeculativeResponder:
+    # starts on a reply when a speaker pauses for a moment, before the endpoint says they're done.
+    # it's cancelled if they keep talking and used if the final transcript is what it was started with
+    def __init__(self, db: PersistentData):
+        self.db = db
+        self.pending: dict[int, tuple[str, asyncio.Task]] = {}  # speaker id -> (speech, generation)
+        self.started = 0
+        self.hits = 0
+        self.misses = 0  # transcript changed
+        self.cancelled = 0  # they kept talking
+
+    def start(self, speaker: discord.User, speech: str, generate: Callable[[], Awaitable[str]]):
+        self.cancel(speaker.id)
+        self.started += 1
+        self.pending[speaker.id] = (speech, asyncio.ensure_future(self._run(speaker, speech, generate)))
+        logger.debug(f"Speculatively replying to {speaker.id}: {speech}")
+
+    async def _run(self, speaker: discord.User, speech: str, generate: Callable[[], Awaitable[str]]) -> tuple[int, str]:
+        # the speech is in the history while the reply is generated, like it would be for the final transcript
+        row = self.db.speech(speaker, speech)
+        try:
+            return row, await generate()
+        except BaseException:
+            self.db.remove_row(row)
+            raise
+
+    def _discard(self, task: asyncio.Task):
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            self.db.remove_row(task.result()[0])
+
+    def cancel(self, speaker_id: int):
+        pending = self.pending.pop(speaker_id, None)
+        if pending:
+            self._discard(pending[1])
+            self.cancelled += 1
+
+    async def take(self, speaker_id: int, speech: str) -> Union[str, None]:
+        # the reply for the final transcript, if one was started for the same speech. it's already in the history
+        pending = self.pending.pop(speaker_id, None)
+        if pending is None:
+            return None
+        if pending[0] != speech:
+            logger.debug(f"Speculative reply to {speaker_id} discarded, the transcript changed")
+            self._discard(pending[1])
+            self.misses += 1
+            return None
+        try:
+            _, response = await pending[1]
+        except asyncio.CancelledError:
+            if not pending[1].cancelled():
+                raise  # on_speech itself was cancelled
+            # discarded after it was handed to us, e.g. they started talking again in between
+            logger.debug(f"Speculative reply to {speaker_id} was cancelled, generating it again")
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.warn(f"Speculative reply failed, generating it again. {str(e)}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response
+
+    def summary(self) -> str:
+        if not self.started:
+            return "*No speculative replies yet.*"
+        return (f"{self.started} started, {self.hits} used ({round(self.hits / self.started * 100)}% hit rate), "
+                f"{self.cancelled} cancelled (kept talking), {self.misses} discarded (transcript changed)")
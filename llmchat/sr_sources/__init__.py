@@ -2,16 +2,78 @@ from discord import User, Client
 from llmchat.config import Config
 from llmchat.persistence import PersistentData
 from speech_recognition import AudioData
+from llmchat.logger import logger
 from typing import Union
+import numpy as np
+import time
+
+
+class RecognitionStats:
+    def __init__(self):
+        self.jobs = 0
+        self.audio_seconds = 0.0
+        self.queue_wait = 0.0
+        self.recognition_time = 0.0
+        self.slowest = 0.0
+
+    def record(self, audio_seconds: float, queue_wait: float, recognition_time: float):
+        self.jobs += 1
+        self.audio_seconds += audio_seconds
+        self.queue_wait += queue_wait
+        self.recognition_time += recognition_time
+        self.slowest = max(self.slowest, recognition_time)
+
+    def summary(self) -> str:
+        if not self.jobs:
+            return "*No utterances yet.*"
+        return (f"{self.jobs} utterance(s), avg wait {round(self.queue_wait / self.jobs, 2)}s, avg recognition {round(self.recognition_time / self.jobs, 2)}s"
+                f" (slowest {round(self.slowest, 2)}s), real-time factor {round(self.recognition_time / max(self.audio_seconds, 0.001), 2)}")
+
 
 class SRSource:
     def __init__(self, client: Client, config: Config, db: PersistentData):
         self.config = config
         self.db = db
         self.client = client
+        self.stats = RecognitionStats()
 
     def recognize_speech(self, data: AudioData) -> Union[str, None]:
         return NotImplementedError()
 
+    def recognize_array(self, samples: np.ndarray, sample_rate: int, channels: int) -> Union[str, None]:
+        # samples: int16 (samples, channels), usually a view into the voice buffer so it must not be kept around.
+        # sources that can work with the array directly should override this
+        # interleaved channels are passed on as one stream at sample_rate * channels
+        return self.recognize_speech(AudioData(samples, sample_rate * channels, samples.dtype.itemsize))
+
+    def transcribe(self, samples: np.ndarray, sample_rate: int, channels: int, queued_at: float = None) -> Union[str, None]:
+        # entry point for the voice sink, records how long the utterance waited and took to recognize
+        start_time = time.time()
+        try:
+            return self.recognize_array(samples, sample_rate, channels)
+        finally:
+            audio_seconds = len(samples) / sample_rate
+            recognition_time = time.time() - start_time
+            queue_wait = start_time - queued_at if queued_at else 0.0
+            self.stats.record(audio_seconds, queue_wait, recognition_time)
+            logger.debug(f"Recognized {round(audio_seconds, 1)}s of audio in {round(recognition_time, 2)}s (waited {round(queue_wait, 2)}s)")
+
+    def summary(self) -> str:
+        # shown in /info
+        return self.stats.summary()
+
+    async def load(self):
+        # loads / warms up the service, called before it starts serving
+        pass
+
+    async def warmup(self):
+        # runs a dummy input through the model so the first real request doesn't pay for first-run overhead
+        pass
+
     async def unload(self):
-        pass
\ No newline at end of file
+        pass
+
+    @property
+    def busy(self) -> bool:
+        # True while a request is using the model, it's only unloaded once it's idle
+        return getattr(getattr(self, "model", None), "in_use", 0) > 0
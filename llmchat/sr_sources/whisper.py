@@ -3,29 +3,176 @@ from discord import User, Client
 from llmchat.config import Config
 from llmchat.persistence import PersistentData
 from speech_recognition import AudioData
-from transformers import WhisperForConditionalGeneration, WhisperProcessor, WhisperTokenizerFast
-import torch
 from llmchat.logger import logger
+from concurrent.futures import Future
+from math import gcd
+from scipy.signal import resample_poly
 import numpy as np
+import threading
+import time
 
-class Whisper(SRSource):
-    def __init__(self, client: Client, config: Config, db: PersistentData):
-        super(Whisper, self).__init__(client, config, db)
+WHISPER_SAMPLE_RATE = 16_000
+WHISPER_TIERS = {
+    "tiny": "openai/whisper-tiny.en",
+    "base": "openai/whisper-base.en",
+    "small": "openai/whisper-small.en",
+}
+MAX_DECODE_TOKENS = 440  # the decoder has 448 positions, some go to the prompt
+
+
+def to_whisper_input(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    # int16 (samples, channels) -> mono float32 at 16khz, downmixed & scaled in one pass then polyphase resampled
+    mono = samples.mean(axis=1, dtype=np.float32) if samples.ndim == 2 else samples.astype(np.float32)
+    mono *= 1 / 32768
+    if sample_rate == WHISPER_SAMPLE_RATE:
+        return mono
+    g = gcd(WHISPER_SAMPLE_RATE, sample_rate)
+    return resample_poly(mono, WHISPER_SAMPLE_RATE // g, sample_rate // g).astype(np.float32, copy=False)
+
+
+class WhisperModel:
+    # no discord dependencies so it can also be hosted by the model server
+    def __init__(self, tier: str = "base", quantize: bool = False):
+        from transformers import WhisperForConditionalGeneration, WhisperProcessor, WhisperTokenizerFast
+        import torch
+        if tier not in WHISPER_TIERS:
+            raise Exception(f"Unknown Whisper model {tier}, use one of {', '.join(WHISPER_TIERS.keys())}")
+        name = WHISPER_TIERS[tier]
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Loading whisper model on {self.device}")
-        self.model = WhisperForConditionalGeneration.from_pretrained("openai/whisper-base.en", cache_dir="models/whisper").to(self.device)
-        self.tokenizer = WhisperTokenizerFast.from_pretrained("openai/whisper-base.en", cache_dir="models/whisper")
-        self.processor = WhisperProcessor.from_pretrained("openai/whisper-base.en", cache_dir="models/whisper", tokenizer=self.tokenizer)
+        logger.info(f"Loading whisper {tier} on {self.device}")
+        self.model = WhisperForConditionalGeneration.from_pretrained(name, cache_dir="models/whisper").to(self.device)
+        if quantize:
+            if self.device == "cpu":
+                # int8 weights for the linear layers, activations are quantized on the fly
+                self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+                logger.info("Whisper quantized to int8")
+            else:
+                logger.warn("Whisper int8 quantization only works on the CPU, ignoring Whisper.quantize")
+        self.model.eval()
+        self.tokenizer = WhisperTokenizerFast.from_pretrained(name, cache_dir="models/whisper")
+        self.processor = WhisperProcessor.from_pretrained(name, cache_dir="models/whisper", tokenizer=self.tokenizer)
 
-    def recognize_speech(self, data: AudioData):
-        resampled = data.get_raw_data(convert_rate=16_000)
-        resampled = np.frombuffer(resampled, dtype=np.int16).flatten().astype(np.float32) / 32768.0
-        inputs = self.processor(resampled, return_tensors="pt", sampling_rate=16_000).input_features.to(self.device)
-        predicted_ids = self.model.generate(inputs, max_length=480_000)
-        decoded = self.processor.batch_decode(predicted_ids, skip_special_tokens=True, normalize=True)[0]
-        return decoded
+    @staticmethod
+    def max_tokens(samples: np.ndarray) -> int:
+        # nobody says more than ~10 tokens a second, stops runaway repetition from decoding the whole context
+        return min(16 + int(len(samples) / WHISPER_SAMPLE_RATE * 10), MAX_DECODE_TOKENS)
+
+    def transcribe(self, samples: np.ndarray) -> str:
+        # samples: mono float32 at 16khz
+        return self.transcribe_batch([(samples,)])[0]
+
+    def transcribe_batch(self, batch: list[tuple[np.ndarray]]) -> list[str]:
+        # args of several transcribe calls, also used by the model server for calls that queued up together.
+        # every input is padded to whisper's 30s window anyway, so they go through generate as one tensor
+        import torch
+        samples = [args[0] for args in batch]
+        inputs = self.processor(samples, return_tensors="pt", sampling_rate=WHISPER_SAMPLE_RATE).input_features.to(self.device)
+        with torch.inference_mode():
+            predicted_ids = self.model.generate(inputs, max_new_tokens=max([self.max_tokens(s) for s in samples]))
+        return self.processor.batch_decode(predicted_ids, skip_special_tokens=True, normalize=True)
+
+    def warmup(self):
+        self.transcribe(np.zeros(16_000, dtype=np.float32))
 
     def __del__(self):
+        import torch
         del self.model
         del self.processor
         torch.cuda.empty_cache()
+
+
+class TranscriptionBatcher:
+    # utterances that finish while whisper is busy are decoded together in one generate call. the first caller runs
+    # the batch, so a single speaker never waits. when several people were just recognized, it holds the batch open
+    # for window seconds to pick up utterances that finish right after
+    BUSY_PERIOD = 1.0  # seconds since the last batch that count as multi-speaker load
+
+    def __init__(self, transcribe_batch, window: float = 0.05, max_batch: int = 8):
+        self.transcribe_batch = transcribe_batch
+        self.window = window
+        self.max_batch = max(max_batch, 1)
+        self.pending: list[tuple[np.ndarray, Future]] = []
+        self.running = False
+        self.last_batch = 0.0
+        self.last_batch_size = 0
+        self.batches = 0
+        self.utterances = 0
+        self._cond = threading.Condition()
+
+    def transcribe(self, samples: np.ndarray) -> str:
+        future = Future()
+        with self._cond:
+            self.pending.append((samples, future))
+            self._cond.notify_all()
+        while not future.done():
+            with self._cond:
+                while self.running and not future.done():
+                    self._cond.wait()
+                if future.done():
+                    break
+                self.running = True
+                if len(self.pending) > 1 or (self.last_batch_size > 1 and time.time() - self.last_batch < self.BUSY_PERIOD):
+                    deadline = time.time() + self.window
+                    while len(self.pending) < self.max_batch and time.time() < deadline:
+                        self._cond.wait(deadline - time.time())
+                batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+                self.last_batch = time.time()
+            try:
+                self._run(batch)
+            finally:
+                with self._cond:
+                    self.running = False
+                    self.last_batch_size = len(batch)
+                    self.batches += 1
+                    self.utterances += len(batch)
+                    self._cond.notify_all()
+        return future.result()
+
+    def _run(self, batch: list[tuple[np.ndarray, Future]]):
+        try:
+            results = self.transcribe_batch([(samples,) for samples, _ in batch])
+            for (_, f), result in zip(batch, results):
+                f.set_result(result)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # one bad utterance shouldn't fail everyone else's
+            logger.warn(f"Whisper batch of {len(batch)} failed, recognizing them one by one. {str(e)}")
+            for item in batch:
+                self._run([item])
+
+    def summary(self) -> str:
+        if not self.batches:
+            return "*No batches yet.*"
+        return f"{self.utterances} utterance(s) in {self.batches} batch(es), avg batch {round(self.utterances / self.batches, 2)}"
+
+
+class Whisper(SRSource):
+    def __init__(self, client: Client, config: Config, db: PersistentData):
+        super(Whisper, self).__init__(client, config, db)
+        self.model = client.create_model("whisper", WhisperModel, preload=False, tier=config.whisper_model, quantize=config.whisper_quantize)
+        # looks the model up on every batch, it's replaced on unload
+        self.batcher = TranscriptionBatcher(lambda batch: self.model.transcribe_batch(batch), config.whisper_batch_window, config.whisper_batch_size)
+
+    def recognize_speech(self, data: AudioData):
+        resampled = data.get_raw_data(convert_rate=WHISPER_SAMPLE_RATE)
+        resampled = np.frombuffer(resampled, dtype=np.int16).flatten().astype(np.float32) / 32768.0
+        return self.batcher.transcribe(resampled)
+
+    def recognize_array(self, samples: np.ndarray, sample_rate: int, channels: int):
+        # skips AudioData, also sends a third of the data to the model server
+        return self.batcher.transcribe(to_whisper_input(samples, sample_rate))
+
+    def summary(self) -> str:
+        return f"{self.stats.summary()}\n{self.batcher.summary()}"
+
+    async def load(self):
+        await self.client.loop.run_in_executor(None, self.model.load)
+
+    async def warmup(self):
+        await self.client.loop.run_in_executor(None, self.model.warmup)
+
+    async def unload(self):
+        await self.client.release_model(self.model)
+        self.model = None
@@ -26,6 +26,22 @@ class TTSSource:
     def populate_embed(self, embed: Embed):
         pass
 
+    async def load(self):
+        # loads / warms up the service, called before it starts serving
+        pass
+
+    async def warmup(self):
+        # runs a dummy input through the model so the first real request doesn't pay for first-run overhead
+        pass
+
+    async def unload(self):
+        pass
+
+    @property
+    def busy(self) -> bool:
+        # True while a request is using the model, it's only unloaded once it's idle
+        return getattr(getattr(self, "model", None), "in_use", 0) > 0
+
     @property
     def current_voice_name(self) -> str:
         return "Unknown voice"
@@ -7,14 +7,13 @@ from discord import User, Client
 from llmchat.config import Config
 from llmchat.persistence import PersistentData
 from llmchat.logger import logger
-import torch
-import torchaudio
 import io
 
 
-class SileroTTS(TTSSource):
-    def __init__(self, client: Client, config: Config, db: PersistentData):
-        super(SileroTTS, self).__init__(client, config, db)
+class SileroModel:
+    # no discord dependencies so it can also be hosted by the model server
+    def __init__(self):
+        import torch
         device = torch.device('cpu') if not torch.cuda.is_available() else torch.device('cuda')
         if not os.path.isdir("models/torch/"):
             os.mkdir("models/torch/")
@@ -22,13 +21,36 @@ class SileroTTS(TTSSource):
         self.model, example_text = torch.hub.load(repo_or_dir='snakers4/silero-models', model='silero_tts', language='en', speaker="v3_en", device=device)
         logger.info("Silero loaded.")
 
-    async def generate_speech(self, content: str) -> io.BufferedIOBase:
-        audio: torch.Tensor = await self.client.loop.run_in_executor(None, lambda: self.model.apply_tts(text=content, sample_rate=48000, speaker=self.config.silero_voice))
+    def synthesize(self, text: str, speaker: str) -> bytes:
+        import torchaudio
+        audio = self.model.apply_tts(text=text, sample_rate=48000, speaker=speaker)
         audio = audio.unsqueeze(0)
         buf = io.BytesIO()
         torchaudio.save(buf, audio, 48000, format="wav")
-        buf.seek(0)
-        return buf
+        return buf.getvalue()
+
+    def warmup(self):
+        self.synthesize("Hello.", "en_0")
+
+
+class SileroTTS(TTSSource):
+    def __init__(self, client: Client, config: Config, db: PersistentData):
+        super(SileroTTS, self).__init__(client, config, db)
+        self.model = client.create_model("silero", SileroModel, preload=False)
+
+    async def generate_speech(self, content: str) -> io.BufferedIOBase:
+        data = await self.client.loop.run_in_executor(None, lambda: self.model.synthesize(content, self.config.silero_voice))
+        return io.BytesIO(data)
+
+    async def load(self):
+        await self.client.loop.run_in_executor(None, self.model.load)
+
+    async def warmup(self):
+        await self.client.loop.run_in_executor(None, self.model.warmup)
+
+    async def unload(self):
+        await self.client.release_model(self.model)
+        self.model = None
 
     @property
     def current_voice_name(self) -> str:
@@ -0,0 +1,97 @@
+from collections import deque
+import numpy as np
+
+# endpoint_mode -> (pause percentile, margin, silence limit before enough pauses were seen)
+ENDPOINT_MODES = {
+    "fast": (75, 1.2, 0.8),
+    "balanced": (90, 1.5, 1.2),
+    "accurate": (97, 2.0, 1.5),
+}
+
+
+class StreamingVAD:
+    # frame-level voice activity detection from running energy & zero-crossing statistics, one per speaker
+    def __init__(self, frame_duration: float = 0.02, threshold_db: float = 9.0, hangover: float = 0.2,
+                 min_energy: float = 100.0 ** 2, max_zcr: float = 0.35):
+        self.ratio = 10 ** (threshold_db / 10)  # energy above the noise floor that counts as voice
+        self.min_energy = min_energy  # mean square of an int16 signal, ~-50 dBFS
+        self.max_zcr = max_zcr  # more zero crossings than this is hiss / clicks rather than voice
+        self.hangover_frames = max(int(hangover / frame_duration), 0)
+        self.noise_floor = min_energy
+        self.energy = 0.0
+        self.zcr = 0.0
+        self._hangover_left = 0
+
+    def process(self, frame: np.ndarray) -> bool:
+        # frame: int16 samples, (samples, channels) or (samples,). returns whether the frame is (still) speech
+        samples = frame.mean(axis=1, dtype=np.float32) if frame.ndim == 2 else frame.astype(np.float32)
+        self.energy = float(np.dot(samples, samples)) / max(len(samples), 1)
+        self.zcr = float(np.count_nonzero(np.diff(np.signbit(samples)))) / max(len(samples) - 1, 1)
+
+        threshold = max(self.noise_floor * self.ratio, self.min_energy)
+        # loud enough frames count even with a high zcr (fricatives)
+        voiced = self.energy > threshold and (self.zcr < self.max_zcr or self.energy > threshold * 16)
+
+        # the floor follows quiet frames quickly and only creeps up (~10%/s) while there's voice, so steady noise is learned
+        if self.energy < self.noise_floor:
+            self.noise_floor += 0.2 * (self.energy - self.noise_floor)
+        elif not voiced:
+            self.noise_floor += 0.05 * (self.energy - self.noise_floor)
+        else:
+            self.noise_floor *= 1.002
+        self.noise_floor = max(self.noise_floor, self.min_energy)
+
+        if voiced:
+            self._hangover_left = self.hangover_frames
+            return True
+        if self._hangover_left > 0:
+            self._hangover_left -= 1
+            return True
+        return False
+
+
+class AdaptiveEndpointer:
+    # decides when an utterance is over, from how long this speaker usually pauses mid-sentence
+    def __init__(self, mode: str = "balanced", min_silence: float = 0.3, max_silence: float = 2.0):
+        if mode not in ENDPOINT_MODES:
+            raise Exception(f"Unknown endpoint mode {mode}, use one of {', '.join(ENDPOINT_MODES.keys())}")
+        self.percentile, self.margin, self.default_silence = ENDPOINT_MODES[mode]
+        self.min_silence = min_silence
+        self.max_silence = max_silence
+        self.pauses = deque(maxlen=100)
+        self.last_voice: float = None
+        self._silence_limit = self.default_silence
+
+    def on_voice(self, now: float):
+        if self.last_voice is not None:
+            gap = now - self.last_voice
+            if gap > 0.1:
+                # a pause that didn't end the utterance
+                self.pauses.append(gap)
+                self._update_limit()
+        self.last_voice = now
+
+    def _update_limit(self):
+        if len(self.pauses) < 5:
+            return
+        limit = float(np.percentile(self.pauses, self.percentile)) * self.margin
+        self._silence_limit = min(max(limit, self.min_silence), self.max_silence)
+
+    @property
+    def silence_limit(self) -> float:
+        return self._silence_limit
+
+    @property
+    def tentative_limit(self) -> float:
+        # a pause this long usually ends the utterance, but not always
+        return max(self._silence_limit / self.margin, self.min_silence)
+
+    def tentative(self, now: float) -> bool:
+        return self.last_voice is not None and now - self.last_voice > self.tentative_limit
+
+    def endpoint(self, now: float) -> bool:
+        return self.last_voice is not None and now - self.last_voice > self._silence_limit
+
+    def reset(self):
+        # call once the utterance was handed off, pause statistics are kept
+        self.last_voice = None
@@ -1,110 +1,233 @@
 import threading
+import functools
 import discord
 import speech_recognition
 import speech_recognition as sr
 import pyaudio
 import numpy as np
 import asyncio
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from logger import logger
 from sr_sources import SRSource
+from vad import StreamingVAD, AdaptiveEndpointer
+from ring_buffer import AudioRingBuffer
+from endpoint_scheduler import EndpointScheduler
+from recognition_pool import RecognitionPool, RecognitionJob
+from config import Config
 import time
+from typing import Union
+
+class SpeakerStream:
+    # audio & endpointing state for one user, so people talking at the same time don't end up in one utterance
+    def __init__(self, user_id: int, frame_duration: float, buffer_size: int, max_utterance: int, channels: int, endpoint_mode: str):
+        self.user_id = user_id
+        self.vad = StreamingVAD(frame_duration)
+        self.endpointer = AdaptiveEndpointer(endpoint_mode)
+        # grows up to max_utterance samples before an utterance is split
+        self.buffer = AudioRingBuffer(buffer_size, channels, max_utterance)
+        self.lock = threading.Lock()
+        self.scheduled = False  # an endpoint check is scheduled
+        self.last_active = time.monotonic()  # endpointing & scheduling use the monotonic clock
+        self.segments: list[Future] = []  # transcripts of the parts of the utterance that were already committed
+        self.speculating = False  # a reply was started at the current pause
+        self.speculation = 0  # attempt counter, tentative transcripts of older attempts are ignored
+        self.replying = False  # their last utterance is being answered, what they say until then is ignored
+
+    @property
+    def pending(self) -> int:
+        return len(self.buffer)
+
+    def take(self) -> tuple[np.ndarray, int]:
+        # view of the utterance & the lease to release once it's recognized
+        self.endpointer.reset()
+        return self.buffer.take()
+
+    def take_segment(self) -> tuple[np.ndarray, int, Future]:
+        # commits the utterance so far, the speaker may still go on
+        audio, lease = self.buffer.take()
+        self.segments.append(Future())
+        return audio, lease, self.segments[-1]
+
 
 class BufferAudioSink(discord.AudioSink):
     sr_source: SRSource
-    def __init__(self, sr_source: SRSource, on_speech, loop: asyncio.BaseEventLoop):
+    IDLE_STREAM_TIMEOUT = 600  # seconds, streams of people that stopped talking are dropped after this
+
+    def __init__(self, sr_source: SRSource, on_speech, loop: asyncio.BaseEventLoop, scheduler: EndpointScheduler, config: Config,
+                 on_tentative_speech=None, on_speech_resumed=None):
         self.on_speech = on_speech
+        # speculation: called with what was said so far at a pause that may end the utterance, and when they go on
+        self.on_tentative_speech = on_tentative_speech
+        self.on_speech_resumed = on_speech_resumed
         self.sr_source = sr_source
         self.loop = loop
+        self.scheduler = scheduler
+        self.closed = False
 
         self.NUM_CHANNELS = discord.opus.Decoder.CHANNELS
         self.NUM_SAMPLES = discord.opus.Decoder.SAMPLES_PER_FRAME
         self.SAMPLE_RATE_HZ = discord.opus.Decoder.SAMPLING_RATE
 
-        self.buffer_pointer = 0
-        self.buffer_size = discord.opus.Decoder.SAMPLING_RATE * 5
-        self.buffer = np.zeros(shape=(self.buffer_size, self.NUM_CHANNELS), dtype='int16')
-        self.speaker = None
-        self.is_speaking = False
-        self._last_spoke = time.time()
-        self.silence_limit = 1.5  # seconds
-
-        # self.stream = DummyAudioSource(self)
-        self.sr = sr.Recognizer()
-        self.slience_thread = threading.Thread(target=self.check_silence)
-        self.slience_thread.start()
-        # self.sr.non_speaking_duration = 0.1
-        # self.sr.pause_threshold = 0.3
-        # self.stop_listen = self.sr.listen_in_background(self.stream, self.listen)
-
-    def listen(self, _, audio_data: sr.AudioData):
-        if self.is_speaking or not self.speaker:
-            return
-
-        debug = True
-        if debug:
-            import sounddevice as sd
-            sd.play(np.frombuffer(audio_data.get_raw_data(), dtype='int16'), self.SAMPLE_RATE_HZ)
-
-        try:
-            logger.info("Recognizing speech...")
-            result = self.sr_source.recognize_speech(audio_data)
-            if result:
-                logger.info(f"Said: {result}")
-                self.loop.create_task(self.on_speech(self.speaker, result))
-        except Exception as e:
-            logger.warn("Exception thrown while processing audio. " + str(e))
-            raise e
-
-    def recognize_buffer(self):
-        self.is_speaking = True
-        speech_data = speech_recognition.AudioData(self.buffer[:self.buffer_pointer], self.SAMPLE_RATE_HZ * 2, discord.opus.Decoder.CHANNELS)
-
+        self.buffer_size = discord.opus.Decoder.SAMPLING_RATE * 10
+        # whisper pads or cuts every input to 30s, longer utterances are flushed in pieces it can take
+        self.max_utterance = discord.opus.Decoder.SAMPLING_RATE * 30
+        self.endpoint_mode = config.voice_endpoint_mode
+        # streaming: parts of an utterance before a pause are recognized while the speaker is still talking
+        self.streaming = config.voice_streaming
+        self.segment_pause = config.voice_segment_pause
+        self.min_segment = int(config.voice_min_segment * self.SAMPLE_RATE_HZ)
+        self.segments = 0
+        self.streams: dict[int, SpeakerStream] = {}
+        # finished utterances are recognized concurrently, capture & endpointing never wait for them
+        self.recognizers = RecognitionPool(self.recognize, config.voice_recognition_workers, config.voice_recognition_queue,
+                                           config.voice_recognition_overflow, config.voice_recognition_max_age)
+
+    def dispatch(self, stream: SpeakerStream):
+        # called with stream.lock held
+        audio, lease = stream.take()
+        segments, stream.segments = stream.segments, []
+        stream.speculating = False  # a tentative transcript that comes in after this is too late
+        self.recognizers.submit(RecognitionJob(stream.user_id, audio, functools.partial(stream.buffer.release, lease), segments=segments))
+
+    def dispatch_segment(self, stream: SpeakerStream):
+        # called with stream.lock held
+        audio, lease, result = stream.take_segment()
+        self.segments += 1
+        logger.debug(f"Committed {round(len(audio) / self.SAMPLE_RATE_HZ, 1)}s of audio from {stream.user_id} while they're still talking")
+        self.recognizers.submit(RecognitionJob(stream.user_id, audio, functools.partial(stream.buffer.release, lease), result=result))
+
+    def speculate(self, stream: SpeakerStream):
+        # called with stream.lock held. they may be done, start on a reply with what they said so far
+        if stream.pending:
+            self.dispatch_segment(stream)
+        stream.speculating = True
+        stream.speculation += 1
+        audio = np.empty(shape=(0, self.NUM_CHANNELS), dtype='int16')
+        self.recognizers.submit(RecognitionJob(stream.user_id, audio, segments=list(stream.segments), speculation=stream.speculation))
+
+    def segment_result(self, user_id: int, segment: Future) -> Union[str, None]:
+        # a segment that takes too long counts as missing, like a dropped one, the rest of the utterance is kept
         try:
-            logger.info("Recognizing speech...")
-            result = self.sr_source.recognize_speech(speech_data)
-            if result:
-                logger.info(f"Said: {result}")
-                self.loop.create_task(self.on_speech(self.speaker, result))
-        except BaseException as e:
-            self.is_speaking = False
-            logger.warn("Exception thrown while processing audio. " + str(e))
-            raise e
-
-        self.buffer_pointer = 0
-        self.buffer = np.zeros(shape=(self.buffer_size, self.NUM_CHANNELS), dtype='int16')  # clear
+            return segment.result(timeout=self.recognizers.max_age)
+        except FutureTimeoutError:
+            logger.warn(f"A segment from {user_id} took longer than {self.recognizers.max_age}s to recognize, skipping it")
+            return None
+
+    def recognize(self, job: RecognitionJob):
+        # runs on a recognition pool thread, which releases the audio afterwards
+        if job.result:
+            job.result.set_result(self.sr_source.transcribe(job.audio, self.SAMPLE_RATE_HZ, self.NUM_CHANNELS, job.queued_at))
+            return
+        if job.speculation is None:
+            logger.info(f"Recognizing speech from {job.user_id}...")
+        # the utterance may have ended right after a committed segment, leaving nothing to recognize
+        result = self.sr_source.transcribe(job.audio, self.SAMPLE_RATE_HZ, self.NUM_CHANNELS, job.queued_at) if len(job.audio) else None
+        if job.segments:
+            # segments were queued before this job, so they're done or being recognized
+            parts = [self.segment_result(job.user_id, segment) for segment in job.segments] + [result]
+            result = " ".join([part.strip() for part in parts if part and part.strip()])
+        if job.speculation is not None:
+            stream = self.streams.get(job.user_id)
+            if result and stream:
+                with stream.lock:
+                    if stream.speculating and stream.speculation == job.speculation:
+                        asyncio.run_coroutine_threadsafe(self.on_tentative_speech(job.user_id, result), self.loop)
+            return
+        if result:
+            logger.info(f"{job.user_id} said: {result}")
+            stream = self.streams.get(job.user_id)
+            if stream:
+                with stream.lock:
+                    stream.replying = True
+            asyncio.run_coroutine_threadsafe(self.on_speech(job.user_id, result), self.loop)
 
     def cleanup(self):
-        pass
+        # called when the bot stops listening, and by the client when it replaces the sink
+        if self.closed:
+            return
+        self.closed = True
+        for user_id in list(self.streams.keys()):
+            self.scheduler.cancel((self, user_id))
+            self.scheduler.cancel((self, user_id, "idle"))
+        self.streams.clear()
+        self.recognizers.shutdown()
+
+    def end_reply(self, user_id: int):
+        # the reply to user_id was spoken (or failed), listen to them again
+        stream = self.streams.get(user_id)
+        if stream:
+            with stream.lock:
+                stream.replying = False
 
     def on_rtcp(self, packet: discord.RTCPPacket):
         pass
 
-    @property
-    def time_since_last_spoke(self):
-        return time.time() - self._last_spoke
-
-    def check_silence(self):
-        while 1:
-            if self.time_since_last_spoke > self.silence_limit and np.abs(self.buffer).max() > 0:
-                self._last_spoke = time.time()
-                self.recognize_buffer()
-            time.sleep(0.1)
+    def can_segment(self, stream: SpeakerStream) -> bool:
+        return self.streaming and stream.pending >= self.min_segment and self.segment_pause < stream.endpointer.silence_limit
+
+    def can_speculate(self, stream: SpeakerStream) -> bool:
+        return self.on_tentative_speech is not None and not stream.speculating and stream.endpointer.tentative_limit < stream.endpointer.silence_limit
+
+    def schedule_endpoint(self, stream: SpeakerStream):
+        # called with stream.lock held. one check per pause instead of one per frame, it's rescheduled if they kept talking
+        if not stream.scheduled:
+            stream.scheduled = True
+            when = stream.endpointer.last_voice + stream.endpointer.silence_limit
+            if self.can_segment(stream):
+                when = min(when, stream.endpointer.last_voice + self.segment_pause)
+            if self.can_speculate(stream):
+                when = min(when, stream.endpointer.last_voice + stream.endpointer.tentative_limit)
+            self.scheduler.schedule((self, stream.user_id), when, functools.partial(self.check_endpoint, stream))
+
+    def check_endpoint(self, stream: SpeakerStream):
+        # runs on the event loop
+        with stream.lock:
+            stream.scheduled = False
+            if self.closed or not (stream.pending or stream.segments) or stream.endpointer.last_voice is None:
+                return
+            now = time.monotonic()
+            if not stream.endpointer.endpoint(now):
+                if self.can_speculate(stream) and stream.endpointer.tentative(now):
+                    self.speculate(stream)
+                elif self.can_segment(stream) and now - stream.endpointer.last_voice >= self.segment_pause:
+                    # a pause that may not end the utterance, recognize what they said so far in the meantime
+                    self.dispatch_segment(stream)
+                self.schedule_endpoint(stream)
+                return
+            logger.debug(f"Endpoint for {stream.user_id} after {round(now - stream.endpointer.last_voice, 2)}s of silence (limit {round(stream.endpointer.silence_limit, 2)}s)")
+            self.dispatch(stream)
+        self.scheduler.schedule((self, stream.user_id, "idle"), now + self.IDLE_STREAM_TIMEOUT, functools.partial(self.forget_stream, stream))
+
+    def forget_stream(self, stream: SpeakerStream):
+        with stream.lock:
+            if stream.pending or time.monotonic() - stream.last_active < self.IDLE_STREAM_TIMEOUT:
+                return
+            if self.streams.get(stream.user_id) is stream:
+                del self.streams[stream.user_id]
+                logger.debug(f"Dropped the voice buffer of {stream.user_id}")
 
     def on_audio(self, voice_data: discord.AudioFrame):
-        if voice_data.user is None:
+        if voice_data.user is None or self.closed:
             return
 
         # adapted from https://github.com/vadimkantorov/discordspeechtotext/
-        self.speaker = voice_data.user.id
-        frame = np.ndarray(shape=(self.NUM_SAMPLES, self.NUM_CHANNELS), dtype='int16', buffer=voice_data.audio)
-        speaking = np.abs(frame).max() > 10
+        user_id = voice_data.user.id
+        stream = self.streams.get(user_id)
+        if stream is None:
+            stream = self.streams[user_id] = SpeakerStream(user_id, self.NUM_SAMPLES / self.SAMPLE_RATE_HZ, self.buffer_size, self.max_utterance, self.NUM_CHANNELS, self.endpoint_mode)
 
-        if speaking and not self.is_speaking:
-            self._last_spoke = time.time()
-            if self.buffer_pointer + self.NUM_SAMPLES >= self.buffer_size:
-                # buffer is full, flush
-                self.recognize_buffer()
-
-            # Add the new frame to the buffer
-            self.buffer[self.buffer_pointer:self.buffer_pointer + self.NUM_SAMPLES] = frame
-            self.buffer_pointer += self.NUM_SAMPLES
+        frame = np.ndarray(shape=(self.NUM_SAMPLES, self.NUM_CHANNELS), dtype='int16', buffer=voice_data.audio)
+        with stream.lock:
+            speaking = stream.vad.process(frame)
+            if speaking and not stream.replying:
+                if not stream.buffer.append(frame):
+                    # 30s without a pause, flush
+                    self.dispatch(stream)
+                    stream.buffer.append(frame)
+                stream.last_active = time.monotonic()
+                stream.endpointer.on_voice(stream.last_active)
+                if stream.speculating:
+                    # they weren't done after all
+                    stream.speculating = False
+                    asyncio.run_coroutine_threadsafe(self.on_speech_resumed(user_id), self.loop)
+                self.schedule_endpoint(stream)
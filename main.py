@@ -7,5 +7,10 @@ from client import DiscordClient
 
 if __name__ == "__main__":
     config = Config()
-    client = DiscordClient(config)
+    if sys.argv[1:3] == ["llama", "tune"]:
+        # python main.py llama tune [model file]
+        from llm_sources.llama_tune import tune
+        tune(config, sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        client = DiscordClient(config)
     
\ No newline at end of file
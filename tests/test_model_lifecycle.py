@@ -0,0 +1,49 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "llmchat"))
+from model_lifecycle import ModelLifecycleManager
+
+
+class FakeModel:
+    loads = 0
+
+    def __init__(self):
+        FakeModel.loads += 1
+
+    def transcribe(self, samples):
+        return f"{len(samples)} samples"
+
+
+def test_attribute_lookups_dont_load():
+    FakeModel.loads = 0
+    model = ModelLifecycleManager().manage("fake", FakeModel)
+    assert getattr(model, "is_remote", True) is False
+    assert not hasattr(model, "missing_method")
+    assert callable(model.transcribe)
+    assert not model.loaded and FakeModel.loads == 0
+    assert model.transcribe([0, 0]) == "2 samples"
+    assert model.loaded and FakeModel.loads == 1
+
+
+def test_release_leaves_model_unloaded():
+    FakeModel.loads = 0
+    manager = ModelLifecycleManager()
+    model = manager.manage("fake", FakeModel, preload=True)
+    assert manager.release(model)
+    # what Client.release_model checks before deciding how to release it
+    getattr(model, "is_remote", False)
+    assert not model.loaded
+    assert FakeModel.loads == 1
+    assert "fake" not in manager.entries
+
+
+def test_release_waits_for_calls_in_use():
+    manager = ModelLifecycleManager()
+    model = manager.manage("fake", FakeModel, preload=True)
+    model.in_use = 1
+    assert not manager.release(model)
+    assert model.loaded and "fake" in manager.entries
+    model.in_use = 0
+    assert manager.release(model)
+    assert not model.loaded